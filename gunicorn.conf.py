@@ -0,0 +1,22 @@
+import multiprocessing
+import os
+
+# Gunicorn configuration for the Electrical Inspector AI backend.
+# Run from the repository root with: gunicorn src.main:app
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+wsgi_app = 'src.main:app'
+
+# The app spends most of its time waiting on the database and AI services,
+# so cooperative gevent workers let each process hold many requests in flight.
+worker_class = 'gevent'
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+
+timeout = 120
+keepalive = 5
+
+
+def pre_fork(server, worker):
+    """Log each worker spawn so restarts under load are visible"""
+    server.log.info("Spawning gevent worker (connections=%s)", worker_connections)
@@ -1,18 +1,37 @@
+# Patch the standard library before anything imports socket/ssl/threading so
+# blocking I/O in request handlers yields to other greenlets.
+from gevent import monkey
+monkey.patch_all()
+
+import logging
+import mimetypes
 import os
 import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+from flask import Flask, make_response, request, send_from_directory
 from flask_cors import CORS
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.auth import auth_bp
 from src.routes.inspection import inspection_bp
 from src.routes.code import code_bp
+from src.services.ai_analysis import ImageAnalysisService, VideoAnalysisService
+from src.services.analysis_queue import analysis_queue
+from src.services.feature_service import FeatureService
+from src.services.query_log import code_query_log
+from src.utils.json_provider import ORJSONProvider, column_json_dumps, column_json_loads
+from src.utils.responses import StaticJSON
+from src.utils.uploads import UploadRequest
+
+# Application log level (WARNING in production keeps info chatter out of the request path)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'WARNING').upper())
 
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), '..', 'electrical-inspector-frontend', 'dist'))
 app.config['SECRET_KEY'] = 'electrical_inspector_ai_secret_key_2025'
+app.json = ORJSONProvider(app)
+app.request_class = UploadRequest
 
 # Enable CORS for all routes
 CORS(app, origins="*")
@@ -23,22 +42,68 @@ app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(inspection_bp, url_prefix='/api')
 app.register_blueprint(code_bp, url_prefix='/api')
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+# Database configuration (PostgreSQL in production, SQLite for local development)
+database_url = os.environ.get('DATABASE_URL', f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}")
+if database_url.startswith('postgres://'):
+    database_url = database_url.replace('postgres://', 'postgresql://', 1)
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Analysis results live in JSON columns; encode and decode them with orjson too
+engine_options = {
+    'json_serializer': column_json_dumps,
+    'json_deserializer': column_json_loads
+}
+
+if database_url.startswith('postgresql'):
+    # psycopg2 blocks in C; route its waits through the gevent hub
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+    
+    engine_options.update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_pre_ping': True
+    })
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+
 # File upload configuration
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
-app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(__file__), '..', 'uploads')
+app.config['UPLOAD_FOLDER'] = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Concurrent AI analyses per worker process; further uploads wait in the queue
+app.config['ANALYSIS_WORKERS'] = int(os.environ.get('ANALYSIS_WORKERS', 5))
+# Analyses a worker will hold (queued plus running) before uploads get a 503
+app.config['ANALYSIS_QUEUE_DEPTH'] = int(os.environ.get('ANALYSIS_QUEUE_DEPTH', 100))
+# Seconds after which an analysis still 'pending' (its worker restarted or crashed) is marked failed
+app.config['ANALYSIS_STALE_AFTER'] = int(os.environ.get('ANALYSIS_STALE_AFTER', 15 * 60))
+
+# Internal Nginx location aliased to the frontend dist folder, e.g. /_static
+app.config['STATIC_ACCEL_PREFIX'] = os.environ.get('STATIC_ACCEL_PREFIX')
+
 # Initialize database
 db.init_app(app)
-with app.app_context():
+code_query_log.init_app(app)
+
+# Shared AI services; the model is built on first use and reused by every request
+app.extensions['image_analysis'] = ImageAnalysisService()
+app.extensions['video_analysis'] = VideoAnalysisService(app.extensions['image_analysis'])
+analysis_queue.init_app(app)
+
+@app.cli.command('init-db')
+def init_db():
+    """Create any missing tables (run once per deploy: flask --app src.main init-db)"""
     db.create_all()
 
+# Workers skip schema creation on boot unless explicitly asked
+if os.environ.get('RUN_MIGRATIONS') == '1':
+    with app.app_context():
+        db.create_all()
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
@@ -47,77 +112,80 @@ def serve(path):
         return "Static folder not configured", 404
 
     if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+        return send_static_file(static_folder_path, path)
     else:
         index_path = os.path.join(static_folder_path, 'index.html')
         if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+            return send_static_file(static_folder_path, 'index.html')
         else:
             return "index.html not found", 404
 
+# Precompressed variants the frontend build may emit, in order of preference
+PRECOMPRESSED_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def send_static_file(directory, filename):
+    """
+    Send a frontend asset without copying it through Python
+    Delegates to Nginx via X-Accel-Redirect when STATIC_ACCEL_PREFIX is set
+    (let Nginx pick .br/.gz with brotli_static/gzip_static). Otherwise serves a
+    precompressed variant the client accepts, falling back to the plain file;
+    send_from_directory hands the open file to wsgi.file_wrapper so Gunicorn
+    can sendfile() it.
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accel_prefix = app.config['STATIC_ACCEL_PREFIX']
+    
+    if accel_prefix:
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{filename}"
+        response.headers['Content-Type'] = mimetype
+    else:
+        encoding = None
+        for candidate, suffix in PRECOMPRESSED_ENCODINGS:
+            if request.accept_encodings[candidate] and os.path.isfile(os.path.join(directory, filename + suffix)):
+                encoding = candidate
+                break
+        
+        if encoding:
+            response = send_from_directory(directory, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(directory, filename, mimetype=mimetype)
+        response.vary.add('Accept-Encoding')
+    
+    # Vite content-hashes everything under assets/, so those never change in place
+    if filename.startswith('assets/'):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    elif filename == 'index.html':
+        response.cache_control.no_cache = True
+    
+    return response
+
+HEALTH_JSON = StaticJSON({
+    'status': 'healthy',
+    'service': 'Electrical Inspector AI Backend',
+    'version': '1.0.0',
+    'features': {
+        'image_analysis': True,
+        'video_analysis': True,
+        'code_query': True,
+        'subscription_tiers': ['freemium', 'basic', 'professional', 'enterprise']
+    }
+}, max_age=0)
+
+FEATURES_JSON = StaticJSON(FeatureService.matrix())
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return {
-        'status': 'healthy',
-        'service': 'Electrical Inspector AI Backend',
-        'version': '1.0.0',
-        'features': {
-            'image_analysis': True,
-            'video_analysis': True,
-            'code_query': True,
-            'subscription_tiers': ['freemium', 'basic', 'professional', 'enterprise']
-        }
-    }
+    return HEALTH_JSON.response()
 
 @app.route('/api/features', methods=['GET'])
 def get_features():
     """Get available features by subscription tier"""
-    return {
-        'freemium': {
-            'monthly_uploads': 3,
-            'image_analysis': True,
-            'video_analysis': False,
-            'photo_library': False,
-            'code_query': True,
-            'microphone': False,
-            'calendar': False,
-            'city_inspector_contact': False
-        },
-        'basic': {  # $9
-            'monthly_uploads': 'unlimited',
-            'image_analysis': True,
-            'video_analysis': False,
-            'photo_library': False,
-            'code_query': True,
-            'microphone': False,
-            'calendar': False,
-            'city_inspector_contact': False,
-            'features': ['Add photos', 'Remove photos', 'Submit photos', 'Pass/fail analysis']
-        },
-        'professional': {  # $19
-            'monthly_uploads': 'unlimited',
-            'image_analysis': True,
-            'video_analysis': False,
-            'photo_library': True,
-            'code_query': True,
-            'microphone': True,
-            'calendar': False,
-            'city_inspector_contact': False,
-            'features': ['All Basic features', 'Photo library', 'Search past inspections', 'Project organization', 'Microphone dictation', 'Drag-drop functionality']
-        },
-        'enterprise': {  # $29
-            'monthly_uploads': 'unlimited',
-            'image_analysis': True,
-            'video_analysis': True,
-            'photo_library': True,
-            'code_query': True,
-            'microphone': True,
-            'calendar': True,
-            'city_inspector_contact': True,
-            'features': ['All Professional features', 'Video upload and analysis', 'Advanced dictation for change orders', 'Calendar scheduling', 'City inspector contact integration']
-        }
-    }
+    return FEATURES_JSON.response()
 
 @app.errorhandler(413)
 def too_large(e):
@@ -132,5 +200,7 @@ def internal_error(e):
     return {'error': 'Internal server error'}, 500
 
 if __name__ == '__main__':
+    with app.app_context():
+        db.create_all()
     app.run(host='0.0.0.0', port=5000, debug=False)
 
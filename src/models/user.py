@@ -1,16 +1,32 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.dialects.postgresql import JSONB
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
+from src.services.feature_service import FeatureService
+from src.utils.passwords import hash_password, verify_password, needs_rehash
 import enum
 
 db = SQLAlchemy()
 
+# Binary JSONB on Postgres (indexable, no re-parse on read); plain JSON on SQLite
+JSONDocument = db.JSON().with_variant(JSONB(), 'postgresql')
+
 class SubscriptionTier(enum.Enum):
     FREEMIUM = "freemium"
     BASIC = "basic"  # $9
     PROFESSIONAL = "professional"  # $19
     ENTERPRISE = "enterprise"  # $29
 
+# Plain dict lookup for request input; avoids Enum.__call__ and its ValueError path
+TIER_BY_VALUE = {tier.value: tier for tier in SubscriptionTier}
+
+# Tiers with a monthly upload cap, enforced inside the counter UPDATE
+MONTHLY_UPLOAD_LIMITS = {
+    tier: FeatureService.for_tier(tier).monthly_uploads
+    for tier in SubscriptionTier
+    if FeatureService.for_tier(tier).monthly_uploads is not None
+}
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -30,29 +46,61 @@ class User(db.Model):
     subscriptions = db.relationship('Subscription', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return verify_password(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return needs_rehash(self.password_hash)
+
+    def needs_monthly_reset(self, now=None):
+        """Check if the upload counter belongs to a previous month"""
+        now = now or datetime.utcnow()
+        if self.last_reset_date is None:
+            return True
+        return (self.last_reset_date.year, self.last_reset_date.month) != (now.year, now.month)
+
+    def uploads_this_month(self):
+        """Uploads counted against the current month, without resetting the stored counter"""
+        return 0 if self.needs_monthly_reset() else (self.monthly_uploads or 0)
 
     def can_upload(self):
         """Check if user can upload based on their subscription tier and usage"""
-        if self.subscription_tier != SubscriptionTier.FREEMIUM:
-            return True
-        
-        # Reset monthly counter if needed
+        limit = FeatureService.for_tier(self.subscription_tier).monthly_uploads
+        return limit is None or self.uploads_this_month() < limit
+
+    @classmethod
+    def consume_upload_slot(cls, user_id):
+        """
+        Check the tier limit and count an upload in one atomic UPDATE, restarting
+        the counter when the stored count belongs to a previous month. Committed
+        with the caller's transaction; returns the new monthly count, or None when
+        the user is already at their limit (or doesn't exist).
+        """
         now = datetime.utcnow()
-        if self.last_reset_date.month != now.month or self.last_reset_date.year != now.year:
-            self.monthly_uploads = 0
-            self.last_reset_date = now
-            db.session.commit()
+        month_start = datetime(now.year, now.month, 1)
+        new_month = or_(cls.last_reset_date.is_(None), cls.last_reset_date < month_start)
+        current_uploads = case((new_month, 0), else_=func.coalesce(cls.monthly_uploads, 0))
         
-        return self.monthly_uploads < 3  # Freemium limit
-
-    def increment_upload_count(self):
-        """Increment upload count for usage tracking"""
-        self.monthly_uploads += 1
-        db.session.commit()
+        # Concurrent uploads serialize on the row lock, so none can slip past the limit.
+        # Each WHEN compares against the column so the tier binds through its Enum type
+        monthly_limit = case(*((cls.subscription_tier == tier, limit) for tier, limit in MONTHLY_UPLOAD_LIMITS.items()))
+        under_limit = or_(
+            cls.subscription_tier.notin_(MONTHLY_UPLOAD_LIMITS),
+            current_uploads < monthly_limit
+        )
+        
+        return db.session.execute(
+            update(cls)
+            .where(cls.id == user_id, under_limit)
+            .values(
+                monthly_uploads=current_uploads + 1,
+                last_reset_date=case((new_month, now), else_=cls.last_reset_date)
+            )
+            .returning(cls.monthly_uploads)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
 
     def __repr__(self):
         return f'<User {self.username}>'
@@ -63,14 +111,18 @@ class User(db.Model):
             'username': self.username,
             'email': self.email,
             'subscription_tier': self.subscription_tier.value,
-            'created_at': self.created_at.isoformat(),
-            'last_login': self.last_login.isoformat() if self.last_login else None,
+            'created_at': self.created_at,
+            'last_login': self.last_login,
             'is_active': self.is_active,
-            'monthly_uploads': self.monthly_uploads,
+            'monthly_uploads': self.uploads_this_month(),
             'can_upload': self.can_upload()
         }
 
 class Subscription(db.Model):
+    __table_args__ = (
+        db.Index('ix_subscription_user_active', 'user_id', 'is_active'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     tier = db.Column(db.Enum(SubscriptionTier), nullable=False)
@@ -84,13 +136,20 @@ class Subscription(db.Model):
             'id': self.id,
             'user_id': self.user_id,
             'tier': self.tier.value,
-            'start_date': self.start_date.isoformat(),
-            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'start_date': self.start_date,
+            'end_date': self.end_date,
             'is_active': self.is_active,
             'stripe_subscription_id': self.stripe_subscription_id
         }
 
 class Inspection(db.Model):
+    # Photo library listing: a user's inspections, newest first. The project_name /
+    # location ilike('%...%') filters can't use a B-tree; on Postgres add trigram
+    # indexes for them (CREATE INDEX ... USING gin (project_name gin_trgm_ops))
+    __table_args__ = (
+        db.Index('ix_inspection_user_created', 'user_id', 'created_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     project_name = db.Column(db.String(255))
@@ -116,19 +175,27 @@ class Inspection(db.Model):
             'user_id': self.user_id,
             'project_name': self.project_name,
             'location': self.location,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'overall_result': self.overall_result,
             'confidence_score': self.confidence_score,
             'ai_analysis': self.ai_analysis,
             'user_rating': self.user_rating,
             'user_feedback': self.user_feedback,
-            'image_count': len(self.images),
-            'video_count': len(self.videos)
+            'image_count': self.image_count,
+            'video_count': self.video_count
         }
 
 class InspectionImage(db.Model):
+    __table_args__ = (
+        # Containment lookups by violation, e.g. violations_found @> '[{"type": "missing_gfci"}]'
+        db.Index(
+            'ix_inspection_image_violations', 'violations_found',
+            postgresql_using='gin', postgresql_ops={'violations_found': 'jsonb_path_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.id'), nullable=False)
+    inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255))
     file_path = db.Column(db.String(500), nullable=False)
@@ -136,9 +203,9 @@ class InspectionImage(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # AI analysis results for this specific image
-    detected_components = db.Column(db.JSON)
-    violations_found = db.Column(db.JSON)
-    confidence_scores = db.Column(db.JSON)
+    detected_components = db.Column(JSONDocument)
+    violations_found = db.Column(JSONDocument)
+    confidence_scores = db.Column(JSONDocument)
     analysis_result = db.Column(db.String(20))  # 'pass', 'fail', 'warning'
     
     def to_dict(self):
@@ -148,7 +215,7 @@ class InspectionImage(db.Model):
             'filename': self.filename,
             'original_filename': self.original_filename,
             'file_size': self.file_size,
-            'uploaded_at': self.uploaded_at.isoformat(),
+            'uploaded_at': self.uploaded_at,
             'detected_components': self.detected_components,
             'violations_found': self.violations_found,
             'confidence_scores': self.confidence_scores,
@@ -157,7 +224,7 @@ class InspectionImage(db.Model):
 
 class InspectionVideo(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.id'), nullable=False)
+    inspection_id = db.Column(db.Integer, db.ForeignKey('inspection.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     original_filename = db.Column(db.String(255))
     file_path = db.Column(db.String(500), nullable=False)
@@ -166,7 +233,7 @@ class InspectionVideo(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # AI analysis results
-    frame_analyses = db.Column(db.JSON)  # Analysis results for key frames
+    frame_analyses = db.Column(JSONDocument)  # Analysis results for key frames
     overall_result = db.Column(db.String(20))  # 'pass', 'fail', 'warning'
     
     def to_dict(self):
@@ -177,12 +244,38 @@ class InspectionVideo(db.Model):
             'original_filename': self.original_filename,
             'file_size': self.file_size,
             'duration': self.duration,
-            'uploaded_at': self.uploaded_at.isoformat(),
+            'uploaded_at': self.uploaded_at,
             'frame_analyses': self.frame_analyses,
             'overall_result': self.overall_result
         }
 
+# Child counts for to_dict. Deferred so plain lookups (e.g. checking an upload's
+# owner) skip the subqueries; listings load them with the row via
+# undefer_group(INSPECTION_COUNTS) instead of lazy-loading each collection
+INSPECTION_COUNTS = 'child_counts'
+Inspection.image_count = db.column_property(
+    select(func.count(InspectionImage.id))
+    .where(InspectionImage.inspection_id == Inspection.id)
+    .correlate_except(InspectionImage)
+    .scalar_subquery(),
+    deferred=True,
+    group=INSPECTION_COUNTS
+)
+Inspection.video_count = db.column_property(
+    select(func.count(InspectionVideo.id))
+    .where(InspectionVideo.inspection_id == Inspection.id)
+    .correlate_except(InspectionVideo)
+    .scalar_subquery(),
+    deferred=True,
+    group=INSPECTION_COUNTS
+)
+
 class CodeQuery(db.Model):
+    __table_args__ = (
+        db.Index('ix_codequery_user_created', 'user_id', 'created_at'),  # search history
+        db.Index('ix_codequery_rating_created', 'user_rating', 'created_at'),  # popular queries
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # Can be anonymous
     query_text = db.Column(db.Text, nullable=False)
@@ -199,7 +292,7 @@ class CodeQuery(db.Model):
             'query_text': self.query_text,
             'response_text': self.response_text,
             'code_references': self.code_references,
-            'created_at': self.created_at.isoformat(),
+            'created_at': self.created_at,
             'response_time': self.response_time,
             'user_rating': self.user_rating
         }
@@ -1,13 +1,16 @@
 from flask import Blueprint, jsonify, request, current_app
 from werkzeug.utils import secure_filename
-from src.models.user import User, Subscription, Inspection, InspectionImage, InspectionVideo, CodeQuery, SubscriptionTier, db
-from datetime import datetime
+from src.models.user import User, Subscription, Inspection, InspectionImage, InspectionVideo, CodeQuery, SubscriptionTier, TIER_BY_VALUE, db
+from src.services.entitlements import EntitlementService
+from datetime import datetime, timedelta
 import os
 import uuid
 import time
 
 auth_bp = Blueprint('auth', __name__)
 
+LAST_LOGIN_RESOLUTION = timedelta(minutes=1)
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """Register a new user"""
@@ -62,9 +65,17 @@ def login():
         if not user.is_active:
             return jsonify({'error': 'Account is deactivated'}), 401
         
-        # Update last login
-        user.last_login = datetime.utcnow()
-        db.session.commit()
+        # Upgrade legacy hashes while the plaintext is at hand
+        if user.password_needs_rehash():
+            user.set_password(data['password'])
+        
+        # Update last login at minute resolution so back-to-back logins skip the write
+        now = datetime.utcnow()
+        if user.last_login is None or now - user.last_login >= LAST_LOGIN_RESOLUTION:
+            user.last_login = now
+        
+        if db.session.is_modified(user):
+            db.session.commit()
         
         return jsonify({
             'message': 'Login successful',
@@ -78,18 +89,22 @@ def login():
 def get_user_subscription(user_id):
     """Get user's current subscription details"""
     try:
+        # Tier and subscription both come from the database: a cached entry could lag
+        # an update_subscription handled by another worker
         user = User.query.get_or_404(user_id)
+        entitlements = EntitlementService.for_user(user)
+        
         active_subscription = Subscription.query.filter_by(
             user_id=user_id, 
             is_active=True
         ).first()
         
         return jsonify({
-            'user_tier': user.subscription_tier.value,
+            'user_tier': entitlements.tier.value,
             'subscription': active_subscription.to_dict() if active_subscription else None,
             'usage': {
-                'monthly_uploads': user.monthly_uploads,
-                'can_upload': user.can_upload()
+                'monthly_uploads': entitlements.monthly_uploads,
+                'can_upload': entitlements.can_upload
             }
         }), 200
         
@@ -104,9 +119,8 @@ def update_subscription(user_id):
         user = User.query.get_or_404(user_id)
         
         # Validate tier
-        try:
-            new_tier = SubscriptionTier(data['tier'])
-        except ValueError:
+        new_tier = TIER_BY_VALUE.get(data.get('tier'))
+        if new_tier is None:
             return jsonify({'error': 'Invalid subscription tier'}), 400
         
         # Deactivate current subscription
@@ -131,6 +145,7 @@ def update_subscription(user_id):
         
         db.session.add(new_subscription)
         db.session.commit()
+        EntitlementService.invalidate(user_id)
         
         return jsonify({
             'message': 'Subscription updated successfully',
@@ -1,11 +1,86 @@
 from flask import Blueprint, jsonify, request
 from src.models.user import CodeQuery, User, db
 from src.services.code_query_service import CodeQueryService
+from src.services.query_cache import QueryResponseCache
+from src.services.query_log import code_query_log
+from src.utils.responses import StaticJSON
 from datetime import datetime
+import threading
 import time
 
 code_bp = Blueprint('code', __name__)
 
+# Longer queries are rejected before they reach the AI service or the database
+MAX_QUERY_LENGTH = 2000
+
+# Search history pagination
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Repeated questions (e.g. the category sample queries) are answered from memory;
+# keys only fold case because answers depend on the exact spacing of the query
+response_cache = QueryResponseCache()
+
+_code_service = None
+_code_service_lock = threading.Lock()
+
+def get_code_service():
+    """Return the shared CodeQueryService, building it on first use"""
+    global _code_service
+    if _code_service is None:
+        with _code_service_lock:
+            if _code_service is None:
+                _code_service = CodeQueryService()
+    return _code_service
+
+CATEGORIES_JSON = StaticJSON({'categories': [
+    {
+        'name': 'Wiring Methods',
+        'description': 'Questions about cable types, conduits, and installation methods',
+        'sample_queries': [
+            'What type of cable should I use for outdoor wiring?',
+            'When is conduit required for electrical wiring?',
+            'What are the requirements for THWN wire?'
+        ]
+    },
+    {
+        'name': 'Grounding & Bonding',
+        'description': 'Questions about electrical grounding and bonding requirements',
+        'sample_queries': [
+            'What size grounding conductor do I need?',
+            'How do I properly bond a metal water pipe?',
+            'What are the grounding requirements for a sub-panel?'
+        ]
+    },
+    {
+        'name': 'Circuit Protection',
+        'description': 'Questions about breakers, fuses, and overcurrent protection',
+        'sample_queries': [
+            'What size breaker do I need for a 20 amp circuit?',
+            'When are GFCI outlets required?',
+            'What is the difference between GFCI and AFCI?'
+        ]
+    },
+    {
+        'name': 'Load Calculations',
+        'description': 'Questions about electrical load calculations and capacity',
+        'sample_queries': [
+            'How do I calculate the load for a residential service?',
+            'What is the demand factor for electric heating?',
+            'How many outlets can I put on a 20 amp circuit?'
+        ]
+    },
+    {
+        'name': 'Special Locations',
+        'description': 'Questions about bathrooms, kitchens, garages, and other special areas',
+        'sample_queries': [
+            'What are the outlet requirements for a kitchen?',
+            'Do I need GFCI protection in a garage?',
+            'What are the clearance requirements around electrical panels?'
+        ]
+    }
+]})
+
 @code_bp.route('/code/query', methods=['POST'])
 def query_electrical_code():
     """
@@ -13,12 +88,15 @@ def query_electrical_code():
     Ask AI anything about the NEC code book
     """
     try:
-        data = request.json
+        data = request.get_json(silent=True)
         
-        if not data.get('query'):
+        if not isinstance(data, dict) or not isinstance(data.get('query'), str) or not data['query'].strip():
             return jsonify({'error': 'Query text is required'}), 400
         
         query_text = data['query'].strip()
+        if len(query_text) > MAX_QUERY_LENGTH:
+            return jsonify({'error': f'Query must be {MAX_QUERY_LENGTH} characters or fewer'}), 400
+        
         user_id = data.get('user_id')  # Optional - can be anonymous
         
         # Validate user if provided
@@ -32,13 +110,24 @@ def query_electrical_code():
         
         # Process the query using AI service
         try:
-            code_service = CodeQueryService()
-            response_data = code_service.process_query(query_text)
+            if CodeQueryService.is_electrical_query(query_text):
+                response_data = response_cache.get(query_text)
+                cached = response_data is not None
+            else:
+                # Off-topic queries get a canned answer without touching the AI service
+                response_data = CodeQueryService.OFF_TOPIC_RESPONSE
+                cached = False
+            
+            if response_data is None:
+                response_data = get_code_service().process_query(query_text)
+                
+                if 'error' not in response_data:
+                    response_cache.set(query_text, response_data, time.time() - start_time)
             
             response_time = time.time() - start_time
             
-            # Create query record
-            code_query = CodeQuery(
+            # Create query record (batched with concurrent requests into one commit)
+            query_id = code_query_log.record(
                 user_id=user_id,
                 query_text=query_text,
                 response_text=response_data.get('response'),
@@ -46,15 +135,13 @@ def query_electrical_code():
                 response_time=response_time
             )
             
-            db.session.add(code_query)
-            db.session.commit()
-            
             return jsonify({
-                'query_id': code_query.id,
+                'query_id': query_id,
                 'response': response_data.get('response'),
                 'references': response_data.get('references', []),
                 'confidence': response_data.get('confidence', 0.0),
                 'response_time': response_time,
+                'cached': cached,
                 'disclaimer': 'This AI response is for informational purposes only. Always consult with a licensed electrician and refer to the official NEC code book for final verification.'
             }), 200
             
@@ -63,18 +150,15 @@ def query_electrical_code():
             print(f"Code Query AI Error: {ai_error}")
             
             # Create query record even for errors
-            code_query = CodeQuery(
+            query_id = code_query_log.record(
                 user_id=user_id,
                 query_text=query_text,
                 response_text="I apologize, but I'm unable to process your query at the moment. Please try again later or consult the official NEC code book.",
                 response_time=time.time() - start_time
             )
             
-            db.session.add(code_query)
-            db.session.commit()
-            
             return jsonify({
-                'query_id': code_query.id,
+                'query_id': query_id,
                 'response': "I apologize, but I'm unable to process your query at the moment. Please try again later or consult the official NEC code book.",
                 'references': [],
                 'confidence': 0.0,
@@ -140,15 +224,19 @@ def get_user_query_history(user_id):
     try:
         user = User.query.get_or_404(user_id)
         
-        # Get user's recent queries
-        queries = CodeQuery.query.filter_by(user_id=user_id) \
-            .order_by(CodeQuery.created_at.desc()) \
-            .limit(50) \
-            .all()
+        page = request.args.get('page', 1, type=int)
+        page_size = request.args.get('page_size', HISTORY_PAGE_SIZE, type=int)
+        
+        # Get user's recent queries, newest first; id breaks created_at ties so pages are stable
+        pagination = CodeQuery.query.filter_by(user_id=user_id) \
+            .order_by(CodeQuery.created_at.desc(), CodeQuery.id.desc()) \
+            .paginate(page=page, per_page=page_size, max_per_page=HISTORY_MAX_PAGE_SIZE, error_out=False)
         
         return jsonify({
-            'queries': [query.to_dict() for query in queries],
-            'total_count': len(queries)
+            'queries': [query.to_dict() for query in pagination.items],
+            'total_count': pagination.total,
+            'page': pagination.page,
+            'page_size': pagination.per_page
         }), 200
         
     except Exception as e:
@@ -157,57 +245,4 @@ def get_user_query_history(user_id):
 @code_bp.route('/code/categories', methods=['GET'])
 def get_code_categories():
     """Get common electrical code categories for quick access"""
-    try:
-        categories = [
-            {
-                'name': 'Wiring Methods',
-                'description': 'Questions about cable types, conduits, and installation methods',
-                'sample_queries': [
-                    'What type of cable should I use for outdoor wiring?',
-                    'When is conduit required for electrical wiring?',
-                    'What are the requirements for THWN wire?'
-                ]
-            },
-            {
-                'name': 'Grounding & Bonding',
-                'description': 'Questions about electrical grounding and bonding requirements',
-                'sample_queries': [
-                    'What size grounding conductor do I need?',
-                    'How do I properly bond a metal water pipe?',
-                    'What are the grounding requirements for a sub-panel?'
-                ]
-            },
-            {
-                'name': 'Circuit Protection',
-                'description': 'Questions about breakers, fuses, and overcurrent protection',
-                'sample_queries': [
-                    'What size breaker do I need for a 20 amp circuit?',
-                    'When are GFCI outlets required?',
-                    'What is the difference between GFCI and AFCI?'
-                ]
-            },
-            {
-                'name': 'Load Calculations',
-                'description': 'Questions about electrical load calculations and capacity',
-                'sample_queries': [
-                    'How do I calculate the load for a residential service?',
-                    'What is the demand factor for electric heating?',
-                    'How many outlets can I put on a 20 amp circuit?'
-                ]
-            },
-            {
-                'name': 'Special Locations',
-                'description': 'Questions about bathrooms, kitchens, garages, and other special areas',
-                'sample_queries': [
-                    'What are the outlet requirements for a kitchen?',
-                    'Do I need GFCI protection in a garage?',
-                    'What are the clearance requirements around electrical panels?'
-                ]
-            }
-        ]
-        
-        return jsonify({'categories': categories}), 200
-        
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
-
+    return CATEGORIES_JSON.response()
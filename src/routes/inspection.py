@@ -1,29 +1,53 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, jsonify, request, current_app, url_for
 from werkzeug.utils import secure_filename
-from src.models.user import User, Inspection, InspectionImage, InspectionVideo, SubscriptionTier, db
-from src.services.ai_analysis import ImageAnalysisService, VideoAnalysisService
+from sqlalchemy.orm import selectinload, undefer_group
+from src.models.user import User, Inspection, InspectionImage, InspectionVideo, SubscriptionTier, INSPECTION_COUNTS, db
+from src.services.analysis_queue import analysis_queue
+from src.services.entitlements import EntitlementService
+from src.services.feature_service import FeatureService
+from src.utils.uploads import save_upload
 from datetime import datetime
 import os
 import uuid
 
 inspection_bp = Blueprint('inspection', __name__)
 
-# Configure upload settings
-UPLOAD_FOLDER = 'uploads'
-ALLOWED_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
-ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm'}
+# Configure upload settings (files go to app.config['UPLOAD_FOLDER'], created at startup)
+ALLOWED_IMAGE_EXTENSIONS = frozenset({'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'})
+ALLOWED_VIDEO_EXTENSIONS = frozenset({'mp4', 'avi', 'mov', 'wmv', 'flv', 'webm'})
+INVALID_IMAGE_TYPE_ERROR = 'Invalid file type. Allowed: ' + ', '.join(sorted(ALLOWED_IMAGE_EXTENSIONS))
+INVALID_VIDEO_TYPE_ERROR = 'Invalid file type. Allowed: ' + ', '.join(sorted(ALLOWED_VIDEO_EXTENSIONS))
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
 
+# Tier gates resolved once from the feature matrix; each check is one set lookup
+_VIDEO_TIERS = frozenset(tier for tier in SubscriptionTier if FeatureService.for_tier(tier).video_analysis)
+_PHOTO_LIB_TIERS = frozenset(tier for tier in SubscriptionTier if FeatureService.for_tier(tier).photo_library)
+
+# Photo library pagination
+INSPECTIONS_PAGE_SIZE = 20
+INSPECTIONS_MAX_PAGE_SIZE = 100
+
+def file_extension(filename):
+    """Lower-cased extension after the last dot, or '' when there is none"""
+    _, dot, extension = filename.rpartition('.')
+    return extension.lower() if dot else ''
+
 def allowed_file(filename, allowed_extensions):
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in allowed_extensions
+    return file_extension(filename) in allowed_extensions
 
-def ensure_upload_directory():
-    """Ensure upload directory exists"""
-    upload_path = os.path.join(os.getcwd(), UPLOAD_FOLDER)
-    if not os.path.exists(upload_path):
-        os.makedirs(upload_path)
-    return upload_path
+def analysis_queue_full():
+    """503 response while this worker's analysis queue is at ANALYSIS_QUEUE_DEPTH"""
+    response = jsonify({'error': 'Too many analyses in progress. Please try again shortly.'})
+    response.headers['Retry-After'] = '30'
+    return response, 503
+
+def upload_limit_exceeded(entitlements):
+    """403 response for a user who has used up this month's uploads"""
+    return jsonify({
+        'error': 'Upload limit exceeded. Please upgrade your subscription.',
+        'monthly_uploads': entitlements.monthly_uploads,
+        'limit': entitlements.monthly_uploads_limit or 'unlimited'
+    }), 403
 
 @inspection_bp.route('/inspections', methods=['POST'])
 def create_inspection():
@@ -61,15 +85,16 @@ def upload_image(inspection_id):
     """Upload and analyze an image for inspection"""
     try:
         inspection = Inspection.query.get_or_404(inspection_id)
-        user = User.query.get_or_404(inspection.user_id)
         
-        # Check upload permissions
-        if not user.can_upload():
-            return jsonify({
-                'error': 'Upload limit exceeded. Please upgrade your subscription.',
-                'monthly_uploads': user.monthly_uploads,
-                'limit': 3 if user.subscription_tier == SubscriptionTier.FREEMIUM else 'unlimited'
-            }), 403
+        # Cached entitlements are per worker, so only a cached "can upload" is trusted.
+        # A cached "no" may predate an upgrade or the monthly reset seen by another
+        # worker: reload it and let the counter UPDATE below make the call
+        entitlements = EntitlementService.get(inspection.user_id)
+        if entitlements is not None and not entitlements.can_upload:
+            EntitlementService.invalidate(inspection.user_id)
+            entitlements = EntitlementService.get(inspection.user_id)
+        if entitlements is None:
+            return jsonify({'error': 'User not found'}), 404
         
         # Check if file is present
         if 'file' not in request.files:
@@ -81,57 +106,57 @@ def upload_image(inspection_id):
         
         # Validate file type
         if not allowed_file(file.filename, ALLOWED_IMAGE_EXTENSIONS):
-            return jsonify({'error': 'Invalid file type. Allowed: ' + ', '.join(ALLOWED_IMAGE_EXTENSIONS)}), 400
+            return jsonify({'error': INVALID_IMAGE_TYPE_ERROR}), 400
+        
+        # Turn the upload away before it takes a slot if analysis can't keep up
+        if analysis_queue.is_full():
+            return analysis_queue_full()
+        
+        # Claim an upload slot; matches no row once the user is at their limit (authoritative check)
+        monthly_uploads = User.consume_upload_slot(inspection.user_id)
+        if monthly_uploads is None:
+            db.session.rollback()
+            
+            # Report the user's current count, re-read now that the cached entry is dropped
+            EntitlementService.invalidate(inspection.user_id)
+            entitlements = EntitlementService.get(inspection.user_id)
+            if entitlements is None:
+                return jsonify({'error': 'User not found'}), 404
+            return upload_limit_exceeded(entitlements)
         
-        # Ensure upload directory exists
-        upload_path = ensure_upload_directory()
+        upload_path = current_app.config['UPLOAD_FOLDER']
         
         # Generate unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        unique_filename = uuid.uuid4().hex + '.' + file_extension(file.filename)
         file_path = os.path.join(upload_path, unique_filename)
         
-        # Save file
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
+        # Save file (links the already-spooled upload into place when possible)
+        file_size = save_upload(file, file_path)
         
-        # Create database record
+        # Create database record; analysis fills in the results later
         inspection_image = InspectionImage(
             inspection_id=inspection_id,
             filename=unique_filename,
             original_filename=file.filename,
             file_path=file_path,
-            file_size=file_size
+            file_size=file_size,
+            analysis_result='pending'
         )
         
+        # Image record and the upload count go out in one commit
         db.session.add(inspection_image)
-        
-        # Increment user upload count
-        user.increment_upload_count()
-        
-        # Perform AI analysis
-        try:
-            analysis_service = ImageAnalysisService()
-            analysis_result = analysis_service.analyze_image(file_path)
-            
-            # Update image record with analysis results
-            inspection_image.detected_components = analysis_result.get('detected_components', [])
-            inspection_image.violations_found = analysis_result.get('violations_found', [])
-            inspection_image.confidence_scores = analysis_result.get('confidence_scores', {})
-            inspection_image.analysis_result = analysis_result.get('overall_result', 'unknown')
-            
-        except Exception as ai_error:
-            # Log AI error but don't fail the upload
-            print(f"AI Analysis Error: {ai_error}")
-            inspection_image.analysis_result = 'error'
-        
         db.session.commit()
+        EntitlementService.invalidate(inspection.user_id)
+        
+        # Hand AI analysis to the background workers
+        analysis_queue.submit_image(inspection_image.id, file_path)
         
         return jsonify({
-            'message': 'Image uploaded and analyzed successfully',
+            'message': 'Image uploaded; analysis in progress',
             'image': inspection_image.to_dict(),
-            'remaining_uploads': 3 - user.monthly_uploads if user.subscription_tier == SubscriptionTier.FREEMIUM else 'unlimited'
-        }), 201
+            'status_url': url_for('inspection.get_inspection_image', inspection_id=inspection_id, image_id=inspection_image.id),
+            'remaining_uploads': entitlements.monthly_uploads_limit - monthly_uploads if entitlements.monthly_uploads_limit is not None else 'unlimited'
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -145,7 +170,7 @@ def upload_video(inspection_id):
         user = User.query.get_or_404(inspection.user_id)
         
         # Check if user has video upload permissions (Enterprise tier only)
-        if user.subscription_tier != SubscriptionTier.ENTERPRISE:
+        if user.subscription_tier not in _VIDEO_TIERS:
             return jsonify({
                 'error': 'Video upload is only available for Enterprise subscribers ($29/month)',
                 'current_tier': user.subscription_tier.value
@@ -161,52 +186,41 @@ def upload_video(inspection_id):
         
         # Validate file type
         if not allowed_file(file.filename, ALLOWED_VIDEO_EXTENSIONS):
-            return jsonify({'error': 'Invalid file type. Allowed: ' + ', '.join(ALLOWED_VIDEO_EXTENSIONS)}), 400
+            return jsonify({'error': INVALID_VIDEO_TYPE_ERROR}), 400
+        
+        if analysis_queue.is_full():
+            return analysis_queue_full()
         
-        # Ensure upload directory exists
-        upload_path = ensure_upload_directory()
+        upload_path = current_app.config['UPLOAD_FOLDER']
         
         # Generate unique filename
-        file_extension = file.filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4()}.{file_extension}"
+        unique_filename = uuid.uuid4().hex + '.' + file_extension(file.filename)
         file_path = os.path.join(upload_path, unique_filename)
         
-        # Save file
-        file.save(file_path)
-        file_size = os.path.getsize(file_path)
+        # Save file (links the already-spooled upload into place when possible)
+        file_size = save_upload(file, file_path)
         
-        # Create database record
+        # Create database record; analysis fills in the results later
         inspection_video = InspectionVideo(
             inspection_id=inspection_id,
             filename=unique_filename,
             original_filename=file.filename,
             file_path=file_path,
-            file_size=file_size
+            file_size=file_size,
+            overall_result='pending'
         )
         
         db.session.add(inspection_video)
-        
-        # Perform AI analysis
-        try:
-            analysis_service = VideoAnalysisService()
-            analysis_result = analysis_service.analyze_video(file_path)
-            
-            # Update video record with analysis results
-            inspection_video.frame_analyses = analysis_result.get('frame_analyses', [])
-            inspection_video.overall_result = analysis_result.get('overall_result', 'unknown')
-            inspection_video.duration = analysis_result.get('duration', 0)
-            
-        except Exception as ai_error:
-            # Log AI error but don't fail the upload
-            print(f"AI Video Analysis Error: {ai_error}")
-            inspection_video.overall_result = 'error'
-        
         db.session.commit()
         
+        # Hand AI analysis to the background workers
+        analysis_queue.submit_video(inspection_video.id, file_path)
+        
         return jsonify({
-            'message': 'Video uploaded and analyzed successfully',
-            'video': inspection_video.to_dict()
-        }), 201
+            'message': 'Video uploaded; analysis in progress',
+            'video': inspection_video.to_dict(),
+            'status_url': url_for('inspection.get_inspection_video', inspection_id=inspection_id, video_id=inspection_video.id)
+        }), 202
         
     except Exception as e:
         db.session.rollback()
@@ -216,7 +230,11 @@ def upload_video(inspection_id):
 def get_inspection(inspection_id):
     """Get inspection details with all images and videos"""
     try:
-        inspection = Inspection.query.get_or_404(inspection_id)
+        # Load both collections up front (one IN query each) instead of lazily
+        inspection = Inspection.query \
+            .options(selectinload(Inspection.images), selectinload(Inspection.videos), undefer_group(INSPECTION_COUNTS)) \
+            .filter_by(id=inspection_id) \
+            .first_or_404()
         
         # Get all images and videos for this inspection
         images = [img.to_dict() for img in inspection.images]
@@ -231,6 +249,30 @@ def get_inspection(inspection_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@inspection_bp.route('/inspections/<int:inspection_id>/images/<int:image_id>', methods=['GET'])
+def get_inspection_image(inspection_id, image_id):
+    """Get an uploaded image and its analysis status"""
+    # Outside the try so an unknown id stays a 404 for clients polling the status
+    inspection_image = InspectionImage.query.filter_by(id=image_id, inspection_id=inspection_id).first_or_404()
+    
+    try:
+        return jsonify(inspection_image.to_dict()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@inspection_bp.route('/inspections/<int:inspection_id>/videos/<int:video_id>', methods=['GET'])
+def get_inspection_video(inspection_id, video_id):
+    """Get an uploaded video and its analysis status"""
+    # Outside the try so an unknown id stays a 404 for clients polling the status
+    inspection_video = InspectionVideo.query.filter_by(id=video_id, inspection_id=inspection_id).first_or_404()
+    
+    try:
+        return jsonify(inspection_video.to_dict()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @inspection_bp.route('/users/<int:user_id>/inspections', methods=['GET'])
 def get_user_inspections(user_id):
     """Get all inspections for a user (Photo Library feature)"""
@@ -238,7 +280,7 @@ def get_user_inspections(user_id):
         user = User.query.get_or_404(user_id)
         
         # Check if user has access to photo library (Professional and Enterprise tiers)
-        if user.subscription_tier == SubscriptionTier.FREEMIUM or user.subscription_tier == SubscriptionTier.BASIC:
+        if user.subscription_tier not in _PHOTO_LIB_TIERS:
             return jsonify({
                 'error': 'Photo library is only available for Professional ($19/month) and Enterprise ($29/month) subscribers',
                 'current_tier': user.subscription_tier.value
@@ -248,9 +290,11 @@ def get_user_inspections(user_id):
         project_name = request.args.get('project_name')
         location = request.args.get('location')
         result_filter = request.args.get('result')  # 'pass', 'fail', 'warning'
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', INSPECTIONS_PAGE_SIZE, type=int)
         
         # Build query
-        query = Inspection.query.filter_by(user_id=user_id)
+        query = Inspection.query.options(undefer_group(INSPECTION_COUNTS)).filter_by(user_id=user_id)
         
         if project_name:
             query = query.filter(Inspection.project_name.ilike(f'%{project_name}%'))
@@ -259,12 +303,15 @@ def get_user_inspections(user_id):
         if result_filter:
             query = query.filter(Inspection.overall_result == result_filter)
         
-        # Order by most recent first
-        inspections = query.order_by(Inspection.created_at.desc()).all()
+        # Order by most recent first; id breaks created_at ties so pages are stable
+        pagination = query.order_by(Inspection.created_at.desc(), Inspection.id.desc()) \
+            .paginate(page=page, per_page=per_page, max_per_page=INSPECTIONS_MAX_PAGE_SIZE, error_out=False)
         
         return jsonify({
-            'inspections': [inspection.to_dict() for inspection in inspections],
-            'total_count': len(inspections)
+            'inspections': [inspection.to_dict() for inspection in pagination.items],
+            'total_count': pagination.total,
+            'page': pagination.page,
+            'per_page': pagination.per_page
         }), 200
         
     except Exception as e:
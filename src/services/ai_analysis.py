@@ -2,9 +2,135 @@ import cv2
 import numpy as np
 import tensorflow as tf
 from PIL import Image
+import functools
 import json
+import logging
 import os
-from typing import Dict, List, Any
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Any, Tuple
+from gevent import monkey
+
+logger = logging.getLogger(__name__)
+
+COMPONENT_CLASSES = [
+    'outlet', 'switch', 'panel', 'conduit', 'junction_box', 
+    'wire', 'breaker', 'gfci_outlet', 'light_fixture', 'meter'
+]
+VIOLATION_TYPES = [
+    'improper_wiring', 'missing_gfci', 'overcrowded_box', 
+    'improper_grounding', 'code_violation', 'safety_hazard'
+]
+
+# gevent's monkey patching turns threading into greenlets, which would run frame
+# preprocessing serially; take the native primitives so OpenCV (which releases the
+# GIL) really spreads across cores
+_start_native_thread, _allocate_native_lock = monkey.get_original('_thread', ['start_new_thread', 'allocate_lock'])
+_NativeSimpleQueue = monkey.get_original('queue', 'SimpleQueue')
+PREPROCESS_WORKERS = min(8, os.cpu_count() or 1)
+
+class _NativeThreadPool:
+    """
+    Fixed set of native worker threads, started on first use and kept for the process
+    Tasks travel through the unpatched SimpleQueue, so idle workers block on a real
+    OS lock rather than the hub. map() waits the same way, so call it from an
+    analysis ThreadPool worker, never from a request greenlet
+    """
+    
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._tasks = _NativeSimpleQueue()
+        self._started = False
+        self._start_lock = _allocate_native_lock()
+    
+    def _ensure_started(self):
+        if self._started:
+            return
+        with self._start_lock:
+            if not self._started:
+                for _ in range(self.workers):
+                    _start_native_thread(self._work, ())
+                self._started = True
+    
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            task()
+    
+    def map(self, fn: Callable, items: List) -> List:
+        """Map fn over items across the workers, keeping input order"""
+        chunks = min(self.workers, len(items))
+        if chunks <= 1:
+            return [fn(item) for item in items]
+        self._ensure_started()
+        
+        results = [None] * len(items)
+        errors = []
+        done_locks = []
+        
+        def run(offset, done):
+            try:
+                for i in range(offset, len(items), chunks):
+                    results[i] = fn(items[i])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                done.release()
+        
+        for offset in range(chunks):
+            done = _allocate_native_lock()
+            done.acquire()
+            done_locks.append(done)
+            self._tasks.put(functools.partial(run, offset, done))
+        
+        for done in done_locks:
+            done.acquire()
+        if errors:
+            raise errors[0]
+        return results
+
+_preprocess_pool = _NativeThreadPool(PREPROCESS_WORKERS)
+
+def _native_map(fn: Callable, items: List) -> List:
+    """Map fn over items on the shared native preprocessing pool, keeping input order"""
+    return _preprocess_pool.map(fn, items)
+
+def _resize_frame(frame: np.ndarray) -> np.ndarray:
+    """BGR frame to a 224x224 RGB uint8 model input"""
+    return cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), (224, 224), interpolation=cv2.INTER_AREA)
+
+# One model per process, shared by every service instance and request
+_shared_model = None
+_shared_model_lock = threading.Lock()
+
+def _create_mock_model():
+    """Create a mock model for demonstration purposes"""
+    # This is a placeholder - in production, this would be a real trained model
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(224, 224, 3)),
+        tf.keras.layers.Conv2D(32, 3, activation='relu'),
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(len(COMPONENT_CLASSES) + len(VIOLATION_TYPES), activation='sigmoid')
+    ])
+    return model
+
+def _get_shared_model():
+    """Build the inspection model on first use and return the shared instance"""
+    global _shared_model
+    if _shared_model is None:
+        with _shared_model_lock:
+            if _shared_model is None:
+                # In a real implementation, this would load a trained TensorFlow model
+                # For now, we'll create a mock model structure
+                logger.info("Loading electrical inspection AI model")
+                
+                # Mock model loading - in production this would be:
+                # _shared_model = tf.keras.models.load_model('path/to/trained_model.h5')
+                
+                _shared_model = _create_mock_model()
+                logger.info("Model loaded successfully")
+    return _shared_model
 
 class ImageAnalysisService:
     """
@@ -14,66 +140,41 @@ class ImageAnalysisService:
     
     def __init__(self):
         self.model = None
-        self.component_classes = [
-            'outlet', 'switch', 'panel', 'conduit', 'junction_box', 
-            'wire', 'breaker', 'gfci_outlet', 'light_fixture', 'meter'
-        ]
-        self.violation_types = [
-            'improper_wiring', 'missing_gfci', 'overcrowded_box', 
-            'improper_grounding', 'code_violation', 'safety_hazard'
-        ]
+        self.component_classes = COMPONENT_CLASSES
+        self.violation_types = VIOLATION_TYPES
         
     def load_model(self):
         """Load the trained electrical inspection model"""
         try:
-            # In a real implementation, this would load a trained TensorFlow model
-            # For now, we'll create a mock model structure
-            print("Loading electrical inspection AI model...")
-            
-            # Mock model loading - in production this would be:
-            # self.model = tf.keras.models.load_model('path/to/trained_model.h5')
+            self.model = _get_shared_model()
             
-            self.model = self._create_mock_model()
-            print("Model loaded successfully")
-            
-        except Exception as e:
-            print(f"Error loading model: {e}")
+        except Exception:
+            logger.exception("Error loading model")
             self.model = None
     
-    def _create_mock_model(self):
-        """Create a mock model for demonstration purposes"""
-        # This is a placeholder - in production, this would be a real trained model
-        model = tf.keras.Sequential([
-            tf.keras.layers.Input(shape=(224, 224, 3)),
-            tf.keras.layers.Conv2D(32, 3, activation='relu'),
-            tf.keras.layers.GlobalAveragePooling2D(),
-            tf.keras.layers.Dense(len(self.component_classes) + len(self.violation_types), activation='sigmoid')
-        ])
-        return model
+    def _read_image(self, image_path: str) -> np.ndarray:
+        """Decode an image file to a BGR array, the layout cv2.VideoCapture frames use"""
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is None:
+            # OpenCV has no GIF decoder; fall back to PIL for anything it can't read
+            with Image.open(image_path) as pil_image:
+                image = cv2.cvtColor(np.asarray(pil_image.convert('RGB')), cv2.COLOR_RGB2BGR)
+        return image
     
-    def preprocess_image(self, image_path: str) -> np.ndarray:
-        """Preprocess image for AI analysis"""
+    def preprocess_frames(self, frames: List[np.ndarray]) -> np.ndarray:
+        """Preprocess decoded BGR video frames into one (N, 224, 224, 3) float32 batch"""
         try:
-            # Load image using PIL
-            image = Image.open(image_path)
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Resize to model input size
-            image = image.resize((224, 224))
-            
-            # Convert to numpy array and normalize
-            image_array = np.array(image) / 255.0
-            
-            # Add batch dimension
-            image_array = np.expand_dims(image_array, axis=0)
-            
-            return image_array
+            # Color conversion and resizing fan out across cores; normalization stays one vectorized pass
+            return self.normalize_inputs(_native_map(_resize_frame, frames))
             
         except Exception as e:
-            raise Exception(f"Error preprocessing image: {e}")
+            raise Exception(f"Error preprocessing frames: {e}")
+    
+    def normalize_inputs(self, inputs: List[np.ndarray]) -> np.ndarray:
+        """Stack 224x224 RGB uint8 model inputs (see _resize_frame) into one float32 batch scaled to [0, 1]"""
+        batch = np.stack(inputs).astype(np.float32)
+        batch *= np.float32(1.0 / 255.0)
+        return batch
     
     def detect_components(self, image_array: np.ndarray) -> List[Dict]:
         """Detect electrical components in the image"""
@@ -102,10 +203,16 @@ class ImageAnalysisService:
             
             return detected_components
             
-        except Exception as e:
-            print(f"Error detecting components: {e}")
+        except Exception:
+            logger.exception("Error detecting components")
             return []
     
+    def detect_components_batch(self, batch: np.ndarray) -> List[List[Dict]]:
+        """Detect components for every image in a preprocessed batch"""
+        # Mock detection works per image; with a trained model this is a single
+        # model call on the whole batch, split per row
+        return [self.detect_components(batch[i:i + 1]) for i in range(len(batch))]
+    
     def check_code_violations(self, components: List[Dict], image_path: str) -> List[Dict]:
         """Check for electrical code violations"""
         violations = []
@@ -138,21 +245,23 @@ class ImageAnalysisService:
             
             return violations
             
-        except Exception as e:
-            print(f"Error checking violations: {e}")
+        except Exception:
+            logger.exception("Error checking violations")
             return []
     
     def calculate_overall_assessment(self, components: List[Dict], violations: List[Dict]) -> Dict:
         """Calculate overall pass/fail assessment"""
         try:
-            high_severity_violations = [v for v in violations if v['severity'] == 'high']
-            medium_severity_violations = [v for v in violations if v['severity'] == 'medium']
+            # One pass over the violations for every severity count
+            severity_counts = Counter(v['severity'] for v in violations)
+            high_severity = severity_counts['high']
+            medium_severity = severity_counts['medium']
             
             # Determine overall result
-            if len(high_severity_violations) > 0:
+            if high_severity > 0:
                 overall_result = 'fail'
                 confidence = 0.85
-            elif len(medium_severity_violations) > 2:
+            elif medium_severity > 2:
                 overall_result = 'warning'
                 confidence = 0.70
             else:
@@ -165,13 +274,13 @@ class ImageAnalysisService:
                 'summary': {
                     'components_detected': len(components),
                     'violations_found': len(violations),
-                    'high_severity': len(high_severity_violations),
-                    'medium_severity': len(medium_severity_violations)
+                    'high_severity': high_severity,
+                    'medium_severity': medium_severity
                 }
             }
             
-        except Exception as e:
-            print(f"Error calculating assessment: {e}")
+        except Exception:
+            logger.exception("Error calculating assessment")
             return {
                 'overall_result': 'error',
                 'confidence': 0.0,
@@ -188,49 +297,78 @@ class ImageAnalysisService:
             if self.model is None:
                 self.load_model()
             
-            # Preprocess image
-            image_array = self.preprocess_image(image_path)
+            # Decode once; the array gives both the model input and the original dimensions
+            image = self._read_image(image_path)
+            image_array = self.preprocess_frames([image])
             
             # Detect components
             components = self.detect_components(image_array)
             
-            # Check for violations
-            violations = self.check_code_violations(components, image_path)
-            
-            # Calculate overall assessment
-            assessment = self.calculate_overall_assessment(components, violations)
+            return self._compile_analysis(components, (image.shape[1], image.shape[0]), image_path)
             
-            # Compile results
-            analysis_result = {
-                'detected_components': components,
-                'violations_found': violations,
-                'overall_result': assessment['overall_result'],
-                'confidence_scores': {
-                    'overall_confidence': assessment['confidence'],
-                    'component_detection': np.mean([c['confidence'] for c in components]) if components else 0.0,
-                    'violation_detection': np.mean([v['confidence'] for v in violations]) if violations else 1.0
-                },
-                'summary': assessment['summary'],
-                'recommendations': self._generate_recommendations(violations),
-                'analysis_metadata': {
-                    'model_version': '1.0.0',
-                    'analysis_timestamp': tf.timestamp().numpy(),
-                    'image_dimensions': Image.open(image_path).size
-                }
-            }
+        except Exception as e:
+            return self._error_result(e)
+    
+    def analyze_model_inputs(self, inputs: List[np.ndarray], image_dimensions: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """
+        Analyze frames already reduced to model inputs by _resize_frame
+        image_dimensions holds each frame's original (width, height). Returns one
+        result per input, in order
+        """
+        try:
+            if self.model is None:
+                self.load_model()
             
-            return analysis_result
+            return self._analyze_batch(self.normalize_inputs(inputs), image_dimensions)
             
         except Exception as e:
-            return {
-                'detected_components': [],
-                'violations_found': [],
-                'overall_result': 'error',
-                'confidence_scores': {'overall_confidence': 0.0},
-                'summary': {},
-                'recommendations': [],
-                'error': str(e)
+            return [self._error_result(e) for _ in inputs]
+    
+    def _analyze_batch(self, batch: np.ndarray, image_dimensions: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """Detect components in a preprocessed batch and build one result per image"""
+        detections = self.detect_components_batch(batch)
+        return [
+            self._compile_analysis(components, dimensions)
+            for components, dimensions in zip(detections, image_dimensions)
+        ]
+    
+    def _compile_analysis(self, components: List[Dict], image_dimensions, image_path: str = None) -> Dict[str, Any]:
+        """Check violations for detected components and build the analysis result"""
+        # Check for violations
+        violations = self.check_code_violations(components, image_path)
+        
+        # Calculate overall assessment
+        assessment = self.calculate_overall_assessment(components, violations)
+        
+        # Compile results
+        return {
+            'detected_components': components,
+            'violations_found': violations,
+            'overall_result': assessment['overall_result'],
+            'confidence_scores': {
+                'overall_confidence': assessment['confidence'],
+                'component_detection': sum(c['confidence'] for c in components) / len(components) if components else 0.0,
+                'violation_detection': sum(v['confidence'] for v in violations) / len(violations) if violations else 1.0
+            },
+            'summary': assessment['summary'],
+            'recommendations': self._generate_recommendations(violations),
+            'analysis_metadata': {
+                'model_version': '1.0.0',
+                'analysis_timestamp': time.time(),
+                'image_dimensions': image_dimensions
             }
+        }
+    
+    def _error_result(self, error: Exception) -> Dict[str, Any]:
+        return {
+            'detected_components': [],
+            'violations_found': [],
+            'overall_result': 'error',
+            'confidence_scores': {'overall_confidence': 0.0},
+            'summary': {},
+            'recommendations': [],
+            'error': str(error)
+        }
     
     def _generate_recommendations(self, violations: List[Dict]) -> List[str]:
         """Generate actionable recommendations based on violations"""
@@ -258,45 +396,58 @@ class VideoAnalysisService:
     Processes video frames and provides temporal analysis
     """
     
-    def __init__(self):
-        self.image_service = ImageAnalysisService()
+    def __init__(self, image_service: ImageAnalysisService = None):
+        self.image_service = image_service or ImageAnalysisService()
         self.frame_extraction_interval = 30  # Extract frame every 30 frames
     
-    def extract_key_frames(self, video_path: str) -> List[str]:
-        """Extract key frames from video for analysis"""
+    def extract_key_frames(self, video_path: str) -> Tuple[List[np.ndarray], List[Tuple[int, int]], float]:
+        """
+        Extract key frames from video for analysis
+        Sampled frames are decoded in windows of PREPROCESS_WORKERS and each window
+        is reduced to 224x224 model inputs on the native preprocessing pool, so a
+        long clip never holds more than one window of full-resolution frames;
+        only the original (width, height) of each is kept. Returns the model
+        inputs, their original dimensions and the video duration
+        """
         try:
             cap = cv2.VideoCapture(video_path)
             frame_count = 0
             extracted_frames = []
+            frame_dimensions = []
+            window = []
             
-            # Create temporary directory for frames
-            temp_dir = os.path.join(os.path.dirname(video_path), 'temp_frames')
-            os.makedirs(temp_dir, exist_ok=True)
+            # Read before release(), which resets every property to 0
+            fps = cap.get(cv2.CAP_PROP_FPS)
             
             while True:
-                ret, frame = cap.read()
-                if not ret:
+                # grab() only demuxes; frames between samples are never decoded
+                if not cap.grab():
                     break
                 
                 # Extract frame at intervals
                 if frame_count % self.frame_extraction_interval == 0:
-                    frame_path = os.path.join(temp_dir, f'frame_{frame_count}.jpg')
-                    cv2.imwrite(frame_path, frame)
-                    extracted_frames.append(frame_path)
+                    ret, frame = cap.retrieve()
+                    if not ret:
+                        break
+                    window.append(frame)
+                    frame_dimensions.append((frame.shape[1], frame.shape[0]))
+                    if len(window) == PREPROCESS_WORKERS:
+                        extracted_frames.extend(_native_map(_resize_frame, window))
+                        window = []
                 
                 frame_count += 1
             
             cap.release()
+            extracted_frames.extend(_native_map(_resize_frame, window))
             
             # Get video duration
-            fps = cap.get(cv2.CAP_PROP_FPS)
             duration = frame_count / fps if fps > 0 else 0
             
-            return extracted_frames, duration
+            return extracted_frames, frame_dimensions, duration
             
-        except Exception as e:
-            print(f"Error extracting frames: {e}")
-            return [], 0
+        except Exception:
+            logger.exception("Error extracting frames from %s", video_path)
+            return [], [], 0
     
     def analyze_video(self, video_path: str) -> Dict[str, Any]:
         """
@@ -305,9 +456,9 @@ class VideoAnalysisService:
         """
         try:
             # Extract key frames
-            frame_paths, duration = self.extract_key_frames(video_path)
+            frames, frame_dimensions, duration = self.extract_key_frames(video_path)
             
-            if not frame_paths:
+            if not frames:
                 return {
                     'frame_analyses': [],
                     'overall_result': 'error',
@@ -320,9 +471,11 @@ class VideoAnalysisService:
             all_components = []
             all_violations = []
             
-            for i, frame_path in enumerate(frame_paths):
+            # Analyze all frames as one batch
+            frame_results = self.image_service.analyze_model_inputs(frames, frame_dimensions)
+            
+            for i, frame_analysis in enumerate(frame_results):
                 try:
-                    frame_analysis = self.image_service.analyze_image(frame_path)
                     frame_analyses.append({
                         'frame_number': i * self.frame_extraction_interval,
                         'timestamp': (i * self.frame_extraction_interval) / 30.0,  # Assuming 30 FPS
@@ -333,16 +486,13 @@ class VideoAnalysisService:
                     all_components.extend(frame_analysis.get('detected_components', []))
                     all_violations.extend(frame_analysis.get('violations_found', []))
                     
-                except Exception as frame_error:
-                    print(f"Error analyzing frame {i}: {frame_error}")
+                except Exception:
+                    logger.exception("Error analyzing frame %d", i)
                     continue
             
             # Calculate overall video assessment
             overall_result = self._calculate_video_assessment(frame_analyses)
             
-            # Clean up temporary frames
-            self._cleanup_temp_frames(frame_paths)
-            
             return {
                 'frame_analyses': frame_analyses,
                 'overall_result': overall_result,
@@ -380,19 +530,3 @@ class VideoAnalysisService:
             return 'pass'
         else:
             return 'warning'
-    
-    def _cleanup_temp_frames(self, frame_paths: List[str]):
-        """Clean up temporary frame files"""
-        try:
-            for frame_path in frame_paths:
-                if os.path.exists(frame_path):
-                    os.remove(frame_path)
-            
-            # Remove temp directory if empty
-            temp_dir = os.path.dirname(frame_paths[0]) if frame_paths else None
-            if temp_dir and os.path.exists(temp_dir) and not os.listdir(temp_dir):
-                os.rmdir(temp_dir)
-                
-        except Exception as e:
-            print(f"Error cleaning up temp frames: {e}")
-
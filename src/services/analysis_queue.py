@@ -0,0 +1,155 @@
+import logging
+from datetime import datetime, timedelta
+import gevent
+from gevent.threadpool import ThreadPool
+from sqlalchemy import update
+from src.models.user import InspectionImage, InspectionVideo, db
+
+logger = logging.getLogger(__name__)
+
+class AnalysisQueue:
+    """
+    Background AI analysis for uploaded images and videos
+    Upload routes store the record as 'pending' and return right away. Inference
+    runs on a bounded pool of native threads (ANALYSIS_WORKERS), so a burst of
+    uploads queues here instead of tying up request workers, and the gevent hub
+    keeps serving while the model runs. Results are written back in an app context.
+
+    The queue is per process and in memory: upload routes check is_full() before
+    accepting a file (ANALYSIS_QUEUE_DEPTH), and rows a dead worker left 'pending'
+    are marked 'error' by a periodic sweep once they are older than
+    ANALYSIS_STALE_AFTER seconds, so clients see them as failed.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pool = None
+        self.max_depth = None  # None means unbounded
+        self.stale_after = None
+        self._outstanding = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self._pool = ThreadPool(app.config.get('ANALYSIS_WORKERS', 5))
+        self.max_depth = app.config.get('ANALYSIS_QUEUE_DEPTH', 100)
+        self.stale_after = app.config.get('ANALYSIS_STALE_AFTER', 15 * 60)
+        app.extensions['analysis_queue'] = self
+        gevent.spawn(self._expire_stale_forever)
+
+    def is_full(self) -> bool:
+        """Whether queued and running analyses have reached ANALYSIS_QUEUE_DEPTH"""
+        return self.max_depth is not None and self._outstanding >= self.max_depth
+
+    def submit_image(self, image_id: int, file_path: str):
+        """Queue analysis for a committed InspectionImage row"""
+        self._outstanding += 1
+        gevent.spawn(self._process_image, image_id, file_path)
+
+    def submit_video(self, video_id: int, file_path: str):
+        """Queue analysis for a committed InspectionVideo row"""
+        self._outstanding += 1
+        gevent.spawn(self._process_video, video_id, file_path)
+
+    def expire_stale(self) -> int:
+        """Mark analyses still pending after ANALYSIS_STALE_AFTER seconds as failed; returns how many"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        with self.app.app_context():
+            try:
+                expired = db.session.execute(
+                    update(InspectionImage)
+                    .where(InspectionImage.analysis_result == 'pending', InspectionImage.uploaded_at < cutoff)
+                    .values(analysis_result='error')
+                ).rowcount
+                expired += db.session.execute(
+                    update(InspectionVideo)
+                    .where(InspectionVideo.overall_result == 'pending', InspectionVideo.uploaded_at < cutoff)
+                    .values(overall_result='error')
+                ).rowcount
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+        if expired:
+            logger.warning("Marked %d stale pending analyses as failed", expired)
+        return expired
+
+    def _expire_stale_forever(self):
+        # Runs at startup (recovering rows left by a restarted or crashed worker) and
+        # then every half stale period; set-based UPDATEs, so every worker can run it
+        while True:
+            try:
+                self.expire_stale()
+            except Exception:
+                logger.exception("Error expiring stale analyses")
+            gevent.sleep(self.stale_after / 2)
+
+    def _process_image(self, image_id: int, file_path: str):
+        try:
+            self._analyze_image(image_id, file_path)
+        finally:
+            self._outstanding -= 1
+
+    def _process_video(self, video_id: int, file_path: str):
+        try:
+            self._analyze_video(video_id, file_path)
+        finally:
+            self._outstanding -= 1
+
+    def _analyze_image(self, image_id: int, file_path: str):
+        analysis_service = self.app.extensions['image_analysis']
+        try:
+            analysis_result = self._pool.apply(analysis_service.analyze_image, (file_path,))
+        except Exception:
+            logger.exception("AI analysis failed for image %d", image_id)
+            analysis_result = None
+
+        # Only touch the database once inference is done, so no connection is held meanwhile
+        with self.app.app_context():
+            try:
+                inspection_image = db.session.get(InspectionImage, image_id)
+                if inspection_image is None:
+                    return
+
+                if analysis_result is None:
+                    inspection_image.analysis_result = 'error'
+                else:
+                    inspection_image.detected_components = analysis_result.get('detected_components', [])
+                    inspection_image.violations_found = analysis_result.get('violations_found', [])
+                    inspection_image.confidence_scores = analysis_result.get('confidence_scores', {})
+                    inspection_image.analysis_result = analysis_result.get('overall_result', 'unknown')
+
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Error saving image analysis %d", image_id)
+
+    def _analyze_video(self, video_id: int, file_path: str):
+        analysis_service = self.app.extensions['video_analysis']
+        try:
+            analysis_result = self._pool.apply(analysis_service.analyze_video, (file_path,))
+        except Exception:
+            logger.exception("AI analysis failed for video %d", video_id)
+            analysis_result = None
+
+        with self.app.app_context():
+            try:
+                inspection_video = db.session.get(InspectionVideo, video_id)
+                if inspection_video is None:
+                    return
+
+                if analysis_result is None:
+                    inspection_video.overall_result = 'error'
+                else:
+                    inspection_video.frame_analyses = analysis_result.get('frame_analyses', [])
+                    inspection_video.overall_result = analysis_result.get('overall_result', 'unknown')
+                    inspection_video.duration = analysis_result.get('duration', 0)
+
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Error saving video analysis %d", video_id)
+
+analysis_queue = AnalysisQueue()
@@ -1,8 +1,239 @@
 import re
 import json
+import threading
 import time
-from typing import Dict, List, Any, Tuple
-import numpy as np
+from collections import Counter, defaultdict
+from functools import lru_cache
+from heapq import nlargest
+from operator import itemgetter
+from typing import Dict, FrozenSet, List, Any, Tuple
+from src.utils.aho_corasick import AhoCorasick
+
+try:
+    import hyperscan
+except ImportError:  # optional; query patterns then run on re alone
+    hyperscan = None
+
+# Word prefixes that show up in electrical code questions beyond the service's own
+# keywords and patterns (regex fragments; the prefilter is built below from all three)
+_GENERAL_DOMAIN_TERMS = (
+    r"electri", r"wir(?:e|ing)", r"outlet", r"receptacle", r"switch", r"breaker", r"panel", r"circuit",
+    r"ground", r"bond", r"gfci", r"afci", r"nec\b", r"code", r"conduit", r"cable", r"conductor", r"volt",
+    r"amp", r"watt", r"load", r"fuse", r"box", r"junction", r"meter", r"service", r"feeder",
+    r"transformer", r"generator", r"light", r"fixture", r"awg", r"romex", r"thhn", r"thwn", r"neutral",
+    r"phase", r"clearance", r"working space", r"disconnect", r"motor", r"kcmil", r"raceway", r"splice",
+    r"inspect", r"permit", r"install", r"bathroom", r"kitchen", r"garage", r"basement", r"outdoor",
+    r"overcurrent", r"electrode", r"article", r"derat", r"surge", r"solar", r"photovoltaic",
+    r"ev charg", r"smoke detector", r"branch", r"busbar", r"subpanel", r"sub-panel", r"nema", r"ufer"
+)
+
+# Phrases inside a query pattern: runs of letters and spaces, e.g. 'junction box' or 'required'
+_PATTERN_LITERAL_RE = re.compile(r'[a-z][a-z ]*[a-z]')
+
+STOP_WORDS = frozenset({
+    'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by',
+    'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did',
+    'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can',
+    'what', 'when', 'where', 'why', 'how'
+})
+
+# Whole words of three or more characters; the length filter runs inside the regex engine
+_WORD_RE = re.compile(r'\b\w{3,}\b')
+
+# Practical notes appended to answers, in this order, when the query mentions any trigger phrase
+_CONTEXT_NOTES = (
+    ('install', ('install', 'installation', 'how to'),
+     "\n\n💡 Practical Tip: Always verify local code requirements as they may be more restrictive than the NEC. Consider consulting with a licensed electrician for complex installations."),
+    ('gfci', ('gfci', 'ground fault'),
+     "\n\n⚠️ Safety Note: GFCI devices should be tested monthly using the TEST and RESET buttons to ensure proper operation."),
+    ('sizing', ('wire size', 'conductor size', 'ampacity'),
+     "\n\n📏 Sizing Note: Always consider voltage drop calculations for long wire runs and ensure proper derating for multiple conductors in conduit.")
+)
+
+# One scan finds every triggered note; the lookahead tries each position, so a
+# trigger is never hidden inside the match of another
+_CONTEXT_TRIGGER_RE = re.compile('(?=' + '|'.join(
+    f"(?P<{name}>{'|'.join(map(re.escape, triggers))})" for name, triggers, _ in _CONTEXT_NOTES
+) + ')')
+
+def _substrings(word: str) -> set:
+    """Every distinct non-empty substring of a word"""
+    return {word[i:j] for i in range(len(word)) for j in range(i + 1, len(word) + 1)}
+
+def _build_nec_database() -> Dict[str, Any]:
+    """Initialize mock NEC database with common code sections"""
+    # In production, this would be a comprehensive vector database
+    # with embeddings of the entire NEC code book
+    # Keywords are tuples since every service instance shares this database read-only
+    return {
+        "210.8": {
+            "title": "Ground-Fault Circuit-Interrupter Protection for Personnel",
+            "content": "Ground-fault circuit-interrupter protection for personnel shall be provided as required in 210.8(A) through (F). The ground-fault circuit-interrupter shall be installed in a readily accessible location.",
+            "subsections": {
+                "210.8(A)": "Dwelling Units. All 125-volt, single-phase, 15- and 20-ampere receptacles installed in bathrooms, garages, outdoors, crawl spaces, basements, kitchens, and other specified locations shall have ground-fault circuit-interrupter protection for personnel.",
+                "210.8(B)": "Other Than Dwelling Units. All 125-volt, single-phase, 15-, 20-, and 30-ampere receptacles installed in bathrooms, kitchens, rooftops, outdoors, and other specified locations shall have ground-fault circuit-interrupter protection for personnel."
+            },
+            "keywords": ("gfci", "ground fault", "protection", "bathroom", "kitchen", "garage", "outdoor", "basement")
+        },
+        "250.66": {
+            "title": "Size of Alternating-Current Grounding Electrode Conductor",
+            "content": "The size of the grounding electrode conductor of a grounded or ungrounded ac system shall not be less than given in Table 250.66, except as permitted in 250.66(A) through (C).",
+            "keywords": ("grounding", "electrode", "conductor", "size", "table")
+        },
+        "314.16": {
+            "title": "Number of Conductors in Outlet, Device, and Junction Boxes, and Conduit Bodies",
+            "content": "Boxes and conduit bodies shall be of sufficient size to provide free space for all enclosed conductors. In no case shall the volume of the box, as calculated in 314.16(A), be less than the fill calculation as calculated in 314.16(B).",
+            "keywords": ("box fill", "conductors", "junction box", "outlet box", "volume", "calculation")
+        },
+        "240.21": {
+            "title": "Location in Circuit",
+            "content": "Overcurrent protection shall be provided in each ungrounded conductor and shall be located at the point where the conductor to be protected receives its supply except as specified in 240.21(A) through (H).",
+            "keywords": ("overcurrent", "protection", "breaker", "fuse", "conductor")
+        },
+        "110.26": {
+            "title": "Spaces About Electrical Equipment",
+            "content": "Sufficient access and working space shall be provided and maintained about all electrical equipment to permit ready and safe operation and maintenance of such equipment.",
+            "keywords": ("clearance", "working space", "electrical equipment", "panel", "access")
+        }
+    }
+
+def _build_query_patterns() -> List[Dict]:
+    """Initialize common query patterns and their responses"""
+    return [
+        {
+            "name": "gfci",
+            "pattern": r"gfci.*?(?:required|need|install)",
+            "response_template": "GFCI protection is required in specific locations per NEC 210.8. For dwelling units, GFCI protection is required for 125-volt, 15- and 20-ampere receptacles in: bathrooms, garages, outdoors, crawl spaces, unfinished basements, kitchens (countertop receptacles), laundry areas, utility rooms, and within 6 feet of sinks.",
+            "primary_reference": "210.8"
+        },
+        {
+            "name": "grounding",
+            "pattern": r"(?:grounding|ground).*?(?:size|conductor|wire)",
+            "response_template": "The size of the grounding electrode conductor is determined by NEC Table 250.66, which bases the size on the largest ungrounded service-entrance conductor or equivalent area for parallel conductors.",
+            "primary_reference": "250.66"
+        },
+        {
+            "name": "box_fill",
+            "pattern": r"(?:box fill|junction box|outlet box).*?(?:calculation|size|conductors)",
+            "response_template": "Box fill calculations are covered in NEC 314.16. Each conductor, device, and fitting counts toward the box fill. The total volume must not exceed the box's rated capacity. Use Table 314.16(A) for standard box volumes and Table 314.16(B) for conductor volumes.",
+            "primary_reference": "314.16"
+        },
+        {
+            "name": "clearance",
+            "pattern": r"(?:clearance|working space|panel).*?(?:distance|feet|inches)",
+            "response_template": "Working space requirements are specified in NEC 110.26. Generally, a minimum of 3 feet of clear working space is required in front of electrical equipment rated 600 volts or less. The width shall be at least 30 inches or the width of the equipment, whichever is greater.",
+            "primary_reference": "110.26"
+        }
+    ]
+
+class _SectionKeywordIndex:
+    """
+    Inverted indexes over section keywords for _search_nec_sections
+    Scoring works on parallel lists indexed by section position (section_ids,
+    keyword_totals) and never touches the full section dicts, which stay in the
+    database for building responses. _keywords_containing maps every substring of
+    a section keyword to how many of each section's keywords contain it;
+    _section_keyword_counts maps each keyword to how many times each section lists
+    it, and an Aho–Corasick automaton over those keywords finds which of them occur
+    inside a query word in one pass.
+    """
+    
+    def __init__(self, nec_database: Dict[str, Any]):
+        self.section_ids = list(nec_database)
+        self.keyword_totals = []
+        self._keywords_containing = defaultdict(Counter)
+        self._section_keyword_counts = defaultdict(Counter)
+        
+        for index, section_data in enumerate(nec_database.values()):
+            section_keywords = section_data.get('keywords', ())
+            self.keyword_totals.append(len(section_keywords))
+            
+            for section_keyword in section_keywords:
+                self._section_keyword_counts[section_keyword][index] += 1
+                for substring in _substrings(section_keyword):
+                    self._keywords_containing[substring][index] += 1
+        
+        self._section_keyword_matcher = AhoCorasick(self._section_keyword_counts)
+        
+        # Query words repeat a lot across questions; remember each word's hits
+        self.keyword_hits = lru_cache(maxsize=4096)(self._compute_keyword_hits)
+    
+    def _compute_keyword_hits(self, keyword: str) -> Counter:
+        """Per section index, how many section keywords contain this keyword or are contained in it"""
+        # keyword inside a section keyword (this also covers an exact match)
+        hits = Counter(self._keywords_containing.get(keyword, {}))
+        
+        # section keyword strictly inside the keyword
+        for section_keyword in self._section_keyword_matcher.find_all(keyword):
+            if section_keyword != keyword:
+                hits.update(self._section_keyword_counts[section_keyword])
+        
+        return hits
+
+# The database, patterns and everything derived from them are read-only, so they are
+# built once at import and every CodeQueryService shares them by reference
+_NEC_DATABASE = _build_nec_database()
+_QUERY_PATTERNS = _build_query_patterns()
+_SECTION_INDEX = _SectionKeywordIndex(_NEC_DATABASE)
+
+def _build_reference_templates(nec_database: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """'section'/'title' pairs for every section and subsection; responses copy one and add 'relevance'"""
+    templates = {}
+    for section_id, section_data in nec_database.items():
+        templates[section_id] = {'section': section_id, 'title': section_data['title']}
+        subsection_title = f"{section_data['title']} - Subsection"
+        for subsection_id in section_data.get('subsections', {}):
+            templates[subsection_id] = {'section': subsection_id, 'title': subsection_title}
+    return templates
+
+_REFERENCE_TEMPLATES = _build_reference_templates(_NEC_DATABASE)
+
+def _build_domain_terms_re(nec_database: Dict[str, Any], patterns: List[Dict]):
+    """
+    Cheap topical prefilter for is_electrical_query
+    Matches a word starting with any general domain term, section keyword or pattern
+    phrase, so every question the database or patterns can answer gets through.
+    Deliberately broad, since turning away a real question costs more than answering noise.
+    """
+    terms = {re.escape(keyword) for section_data in nec_database.values() for keyword in section_data.get('keywords', ())}
+    terms.update(re.escape(literal) for p in patterns for literal in _PATTERN_LITERAL_RE.findall(p['pattern']))
+    terms.update(_GENERAL_DOMAIN_TERMS)
+    return re.compile(r"\b(?:" + '|'.join(sorted(terms)) + ")", re.IGNORECASE)
+
+_DOMAIN_TERMS_RE = _build_domain_terms_re(_NEC_DATABASE, _QUERY_PATTERNS)
+
+# Patterns are unanchored and run with search(), which skips ahead to the first
+# literal instead of backtracking through a leading '.*'. They are tried one at a
+# time in list order so the first listed pattern still wins: a single fused
+# alternation under search() would pick whichever match starts leftmost instead
+_COMPILED_PATTERNS = tuple((re.compile(p['pattern'], re.IGNORECASE | re.DOTALL), p) for p in _QUERY_PATTERNS)
+
+def _compile_hyperscan_patterns(patterns: List[Dict]):
+    """
+    Hyperscan database over the query patterns, or None when hyperscan isn't installed
+    Pattern ids are list positions, so the lowest reported id is the first listed
+    pattern that matches. Hyperscan runs every pattern in one linear
+    scan and never backtracks.
+    """
+    if hyperscan is None:
+        return None
+    
+    database = hyperscan.Database()
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_DOTALL | hyperscan.HS_FLAG_SINGLEMATCH
+    database.compile(
+        expressions=[p['pattern'].encode('ascii') for p in patterns],
+        ids=list(range(len(patterns))),
+        elements=len(patterns),
+        flags=[flags] * len(patterns)
+    )
+    return database
+
+_HYPERSCAN_PATTERNS = _compile_hyperscan_patterns(_QUERY_PATTERNS)
+# One database means one scratch space for the whole process, so scans take turns
+_HYPERSCAN_LOCK = threading.Lock()
+
+def _record_hyperscan_match(pattern_id, start, end, flags, matched_ids):
+    matched_ids.append(pattern_id)
 
 class CodeQueryService:
     """
@@ -10,121 +241,97 @@ class CodeQueryService:
     Implements retrieval-augmented generation for NEC code questions
     """
     
-    def __init__(self):
-        self.nec_database = self._initialize_nec_database()
-        self.common_patterns = self._initialize_query_patterns()
-        
-    def _initialize_nec_database(self) -> Dict[str, Any]:
-        """Initialize mock NEC database with common code sections"""
-        # In production, this would be a comprehensive vector database
-        # with embeddings of the entire NEC code book
-        return {
-            "210.8": {
-                "title": "Ground-Fault Circuit-Interrupter Protection for Personnel",
-                "content": "Ground-fault circuit-interrupter protection for personnel shall be provided as required in 210.8(A) through (F). The ground-fault circuit-interrupter shall be installed in a readily accessible location.",
-                "subsections": {
-                    "210.8(A)": "Dwelling Units. All 125-volt, single-phase, 15- and 20-ampere receptacles installed in bathrooms, garages, outdoors, crawl spaces, basements, kitchens, and other specified locations shall have ground-fault circuit-interrupter protection for personnel.",
-                    "210.8(B)": "Other Than Dwelling Units. All 125-volt, single-phase, 15-, 20-, and 30-ampere receptacles installed in bathrooms, kitchens, rooftops, outdoors, and other specified locations shall have ground-fault circuit-interrupter protection for personnel."
-                },
-                "keywords": ["gfci", "ground fault", "protection", "bathroom", "kitchen", "garage", "outdoor", "basement"]
-            },
-            "250.66": {
-                "title": "Size of Alternating-Current Grounding Electrode Conductor",
-                "content": "The size of the grounding electrode conductor of a grounded or ungrounded ac system shall not be less than given in Table 250.66, except as permitted in 250.66(A) through (C).",
-                "keywords": ["grounding", "electrode", "conductor", "size", "table"]
-            },
-            "314.16": {
-                "title": "Number of Conductors in Outlet, Device, and Junction Boxes, and Conduit Bodies",
-                "content": "Boxes and conduit bodies shall be of sufficient size to provide free space for all enclosed conductors. In no case shall the volume of the box, as calculated in 314.16(A), be less than the fill calculation as calculated in 314.16(B).",
-                "keywords": ["box fill", "conductors", "junction box", "outlet box", "volume", "calculation"]
-            },
-            "240.21": {
-                "title": "Location in Circuit",
-                "content": "Overcurrent protection shall be provided in each ungrounded conductor and shall be located at the point where the conductor to be protected receives its supply except as specified in 240.21(A) through (H).",
-                "keywords": ["overcurrent", "protection", "breaker", "fuse", "conductor"]
-            },
-            "110.26": {
-                "title": "Spaces About Electrical Equipment",
-                "content": "Sufficient access and working space shall be provided and maintained about all electrical equipment to permit ready and safe operation and maintenance of such equipment.",
-                "keywords": ["clearance", "working space", "electrical equipment", "panel", "access"]
-            }
-        }
+    OFF_TOPIC_RESPONSE = {
+        'response': "I can only help with electrical code questions. Please ask about wiring, circuits, grounding, panels, or other NEC requirements.",
+        'references': [],
+        'confidence': 0.0
+    }
     
-    def _initialize_query_patterns(self) -> List[Dict]:
-        """Initialize common query patterns and their responses"""
-        return [
-            {
-                "pattern": r"(?i).*gfci.*(?:required|need|install).*",
-                "response_template": "GFCI protection is required in specific locations per NEC 210.8. For dwelling units, GFCI protection is required for 125-volt, 15- and 20-ampere receptacles in: bathrooms, garages, outdoors, crawl spaces, unfinished basements, kitchens (countertop receptacles), laundry areas, utility rooms, and within 6 feet of sinks.",
-                "primary_reference": "210.8"
-            },
-            {
-                "pattern": r"(?i).*(?:grounding|ground).*(?:size|conductor|wire).*",
-                "response_template": "The size of the grounding electrode conductor is determined by NEC Table 250.66, which bases the size on the largest ungrounded service-entrance conductor or equivalent area for parallel conductors.",
-                "primary_reference": "250.66"
-            },
-            {
-                "pattern": r"(?i).*(?:box fill|junction box|outlet box).*(?:calculation|size|conductors).*",
-                "response_template": "Box fill calculations are covered in NEC 314.16. Each conductor, device, and fitting counts toward the box fill. The total volume must not exceed the box's rated capacity. Use Table 314.16(A) for standard box volumes and Table 314.16(B) for conductor volumes.",
-                "primary_reference": "314.16"
-            },
-            {
-                "pattern": r"(?i).*(?:clearance|working space|panel).*(?:distance|feet|inches).*",
-                "response_template": "Working space requirements are specified in NEC 110.26. Generally, a minimum of 3 feet of clear working space is required in front of electrical equipment rated 600 volts or less. The width shall be at least 30 inches or the width of the equipment, whichever is greater.",
-                "primary_reference": "110.26"
-            }
-        ]
+    @staticmethod
+    def is_electrical_query(query: str) -> bool:
+        """Check whether a query mentions anything in the electrical domain"""
+        return _DOMAIN_TERMS_RE.search(query) is not None
+    
+    # Related question suggestions, offered when any trigger word is among the query keywords
+    _REL_RULES: Tuple[Tuple[FrozenSet[str], Tuple[str, ...]], ...] = (
+        (frozenset({'gfci', 'ground', 'fault'}), (
+            "Where are GFCI outlets required in a kitchen?",
+            "What is the difference between GFCI and AFCI?",
+            "How do I test a GFCI outlet?"
+        )),
+        (frozenset({'wire', 'conductor', 'size'}), (
+            "How do I calculate wire size for a circuit?",
+            "What is the ampacity of 12 AWG wire?",
+            "When do I need to derate wire ampacity?"
+        )),
+        (frozenset({'box', 'fill', 'junction'}), (
+            "How many wires can fit in a junction box?",
+            "What size box do I need for 6 conductors?",
+            "How do I calculate box fill for devices?"
+        ))
+    )
+    MAX_RELATED_QUERIES = 5
+    
+    def __init__(self):
+        self.nec_database = _NEC_DATABASE
+        self.common_patterns = _QUERY_PATTERNS
+        self._compiled_patterns = _COMPILED_PATTERNS
+        self._section_index = _SECTION_INDEX
+        self._reference_templates = _REFERENCE_TEMPLATES
+        self._hyperscan_patterns = _HYPERSCAN_PATTERNS
     
     def _extract_keywords(self, query: str) -> List[str]:
         """Extract relevant keywords from the query"""
-        # Remove common stop words and extract meaningful terms
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of', 'with', 'by', 'is', 'are', 'was', 'were', 'be', 'been', 'have', 'has', 'had', 'do', 'does', 'did', 'will', 'would', 'could', 'should', 'may', 'might', 'must', 'can', 'what', 'when', 'where', 'why', 'how'}
-        
-        # Convert to lowercase and split into words
-        words = re.findall(r'\b\w+\b', query.lower())
-        
-        # Filter out stop words and short words
-        keywords = [word for word in words if word not in stop_words and len(word) > 2]
-        
-        return keywords
+        return self._extract_lowered_keywords(query.lower())
+    
+    @staticmethod
+    def _extract_lowered_keywords(query_lower: str) -> List[str]:
+        """Keywords from an already lower-cased query"""
+        # Split into words of 3+ characters and drop stop words
+        return [word for word in _WORD_RE.findall(query_lower) if word not in STOP_WORDS]
     
     def _search_nec_sections(self, keywords: List[str]) -> List[Tuple[str, float]]:
         """Search NEC database for relevant sections based on keywords"""
-        matches = []
-        
-        for section_id, section_data in self.nec_database.items():
-            score = 0
-            section_keywords = section_data.get('keywords', [])
-            
-            # Calculate relevance score
-            for keyword in keywords:
-                for section_keyword in section_keywords:
-                    if keyword in section_keyword or section_keyword in keyword:
-                        score += 1
-                    elif keyword == section_keyword:
-                        score += 2
-            
-            if score > 0:
-                # Normalize score
-                normalized_score = score / (len(keywords) + len(section_keywords))
-                matches.append((section_id, normalized_score))
+        # Relevance score: one point per (query keyword, section keyword) pair where
+        # either is a substring of the other
+        # Each distinct word is looked up once and weighted by how often it was asked
+        section_index = self._section_index
+        scores = [0] * len(section_index.section_ids)
+        for keyword, occurrences in Counter(keywords).items():
+            for index, hits in section_index.keyword_hits(keyword).items():
+                scores[index] += hits * occurrences
         
-        # Sort by relevance score
-        matches.sort(key=lambda x: x[1], reverse=True)
+        # Normalize score; sections stay in database order so ties sort as before
+        keyword_count = len(keywords)
+        matches = [
+            (section_id, score / (keyword_count + keyword_total))
+            for section_id, score, keyword_total in zip(section_index.section_ids, scores, section_index.keyword_totals)
+            if score > 0
+        ]
         
-        return matches[:3]  # Return top 3 matches
+        # Top 3 by relevance score (nlargest keeps database order among ties, like a stable sort)
+        return nlargest(3, matches, key=itemgetter(1))
     
     def _match_query_patterns(self, query: str) -> Dict[str, Any]:
         """Match query against common patterns"""
-        for pattern_data in self.common_patterns:
-            if re.match(pattern_data['pattern'], query):
-                return {
-                    'response': pattern_data['response_template'],
-                    'primary_reference': pattern_data['primary_reference'],
-                    'confidence': 0.85
-                }
+        # Hyperscan's caseless matching only agrees with re.IGNORECASE on ASCII text
+        if self._hyperscan_patterns is not None and query.isascii():
+            matched_ids = []
+            with _HYPERSCAN_LOCK:
+                self._hyperscan_patterns.scan(query.encode('ascii'), match_event_handler=_record_hyperscan_match, context=matched_ids)
+            if not matched_ids:
+                return None
+            pattern_data = self.common_patterns[min(matched_ids)]
+        else:
+            pattern_data = next((data for pattern, data in self._compiled_patterns if pattern.search(query)), None)
+            if pattern_data is None:
+                return None
         
-        return None
+        return {
+            'response': pattern_data['response_template'],
+            'primary_reference': pattern_data['primary_reference'],
+            'confidence': 0.85
+        }
     
     def _generate_response(self, query: str, relevant_sections: List[Tuple[str, float]]) -> Dict[str, Any]:
         """Generate response based on relevant NEC sections"""
@@ -138,6 +345,7 @@ class CodeQueryService:
         # Get the most relevant section
         primary_section = relevant_sections[0][0]
         primary_data = self.nec_database[primary_section]
+        reference_templates = self._reference_templates
         
         # Build response
         response_parts = []
@@ -145,31 +353,21 @@ class CodeQueryService:
         
         # Add primary section information
         response_parts.append(f"According to NEC {primary_section} ({primary_data['title']}): {primary_data['content']}")
-        references.append({
-            'section': primary_section,
-            'title': primary_data['title'],
-            'relevance': relevant_sections[0][1]
-        })
+        references.append({**reference_templates[primary_section], 'relevance': relevant_sections[0][1]})
         
         # Add subsection information if available
-        if 'subsections' in primary_data:
-            for subsection_id, subsection_content in primary_data['subsections'].items():
-                response_parts.append(f"\n\n{subsection_id}: {subsection_content}")
-                references.append({
-                    'section': subsection_id,
-                    'title': f"{primary_data['title']} - Subsection",
-                    'relevance': relevant_sections[0][1] * 0.9
-                })
+        subsections = primary_data.get('subsections')
+        if subsections:
+            subsection_relevance = relevant_sections[0][1] * 0.9
+            for subsection_id, subsection_content in subsections.items():
+                response_parts += ("\n\n", subsection_id, ": ", subsection_content)
+                references.append({**reference_templates[subsection_id], 'relevance': subsection_relevance})
         
         # Add additional relevant sections
         for section_id, score in relevant_sections[1:]:
             section_data = self.nec_database[section_id]
-            response_parts.append(f"\n\nAlso see NEC {section_id} ({section_data['title']}) for related requirements.")
-            references.append({
-                'section': section_id,
-                'title': section_data['title'],
-                'relevance': score
-            })
+            response_parts += ("\n\nAlso see NEC ", section_id, " (", section_data['title'], ") for related requirements.")
+            references.append({**reference_templates[section_id], 'relevance': score})
         
         response = ''.join(response_parts)
         confidence = min(relevant_sections[0][1] * 1.2, 0.95)  # Cap confidence at 95%
@@ -180,101 +378,92 @@ class CodeQueryService:
             'confidence': confidence
         }
     
-    def _enhance_response_with_context(self, response_data: Dict[str, Any], query: str) -> Dict[str, Any]:
-        """Enhance response with additional context and recommendations"""
-        enhanced_response = response_data['response']
+    def _enhance_response_with_context(self, response_data: Dict[str, Any], query_lower: str) -> Dict[str, Any]:
+        """Enhance response with additional context and recommendations (query_lower is already lower-cased)"""
+        triggered = {match.lastgroup for match in _CONTEXT_TRIGGER_RE.finditer(query_lower)}
         
         # Add practical recommendations based on query type
-        if any(keyword in query.lower() for keyword in ['install', 'installation', 'how to']):
-            enhanced_response += "\n\n💡 Practical Tip: Always verify local code requirements as they may be more restrictive than the NEC. Consider consulting with a licensed electrician for complex installations."
-        
-        if any(keyword in query.lower() for keyword in ['gfci', 'ground fault']):
-            enhanced_response += "\n\n⚠️ Safety Note: GFCI devices should be tested monthly using the TEST and RESET buttons to ensure proper operation."
+        response_parts = [response_data['response']]
+        response_parts.extend(note for name, _, note in _CONTEXT_NOTES if name in triggered)
         
-        if any(keyword in query.lower() for keyword in ['wire size', 'conductor size', 'ampacity']):
-            enhanced_response += "\n\n📏 Sizing Note: Always consider voltage drop calculations for long wire runs and ensure proper derating for multiple conductors in conduit."
-        
-        response_data['response'] = enhanced_response
+        response_data['response'] = ''.join(response_parts)
         return response_data
     
     def process_query(self, query: str) -> Dict[str, Any]:
         """
         Main method to process electrical code queries
-        Returns comprehensive response with NEC references
+        Returns comprehensive response with NEC references (repeat questions are
+        cached by the /code/query route, keyed on the same lower-cased text used
+        here). Unexpected failures are raised to the caller rather than returned
+        as answers.
         """
-        try:
-            # First, try to match against common patterns
-            pattern_match = self._match_query_patterns(query)
-            if pattern_match:
-                # Get detailed information for the matched section
-                section_data = self.nec_database.get(pattern_match['primary_reference'], {})
-                enhanced_response = self._enhance_response_with_context({
-                    'response': pattern_match['response'],
-                    'references': [{
-                        'section': pattern_match['primary_reference'],
-                        'title': section_data.get('title', 'NEC Section'),
-                        'relevance': pattern_match['confidence']
-                    }],
-                    'confidence': pattern_match['confidence']
-                }, query)
-                return enhanced_response
-            
-            # Extract keywords from query
-            keywords = self._extract_keywords(query)
-            
-            if not keywords:
-                return {
-                    'response': "I need more specific information to help you. Please ask about specific electrical components, installations, or code requirements.",
-                    'references': [],
-                    'confidence': 0.1
-                }
-            
-            # Search for relevant NEC sections
-            relevant_sections = self._search_nec_sections(keywords)
-            
-            # Generate response
-            response_data = self._generate_response(query, relevant_sections)
-            
-            # Enhance with additional context
-            enhanced_response = self._enhance_response_with_context(response_data, query)
-            
+        if not isinstance(query, str) or not query.strip():
+            return self._error_response("the query is empty")
+        
+        return self._answer_query(query, query.lower())
+    
+    def _answer_query(self, query: str, query_lower: str) -> Dict[str, Any]:
+        """Run the full matching and response pipeline for one query, lower-cased once by the caller"""
+        # First, try to match against common patterns
+        pattern_match = self._match_query_patterns(query)
+        if pattern_match:
+            # Reference the matched section by its database title
+            primary_reference = pattern_match['primary_reference']
+            reference = self._reference_templates.get(primary_reference) or {'section': primary_reference, 'title': 'NEC Section'}
+            enhanced_response = self._enhance_response_with_context({
+                'response': pattern_match['response'],
+                'references': [{**reference, 'relevance': pattern_match['confidence']}],
+                'confidence': pattern_match['confidence']
+            }, query_lower)
             return enhanced_response
-            
-        except Exception as e:
+        
+        # Extract keywords from query
+        keywords = self._extract_lowered_keywords(query_lower)
+        
+        if not keywords:
             return {
-                'response': f"I encountered an error processing your query: {str(e)}. Please try rephrasing your question or refer to the official NEC code book.",
+                'response': "I need more specific information to help you. Please ask about specific electrical components, installations, or code requirements.",
                 'references': [],
-                'confidence': 0.0,
-                'error': str(e)
+                'confidence': 0.1
             }
+        
+        # Search for relevant NEC sections
+        relevant_sections = self._search_nec_sections(keywords)
+        
+        # Generate response; a section the index knows but the database doesn't is the
+        # one lookup that can fail here
+        try:
+            response_data = self._generate_response(query, relevant_sections)
+        except KeyError as e:
+            return self._error_response(f"unknown NEC section {e}")
+        
+        # Enhance with additional context
+        enhanced_response = self._enhance_response_with_context(response_data, query_lower)
+        
+        return enhanced_response
+    
+    @staticmethod
+    def _error_response(message: str) -> Dict[str, Any]:
+        """Response for a query that couldn't be answered; the 'error' key keeps it out of caches"""
+        return {
+            'response': f"I encountered an error processing your query: {message}. Please try rephrasing your question or refer to the official NEC code book.",
+            'references': [],
+            'confidence': 0.0,
+            'error': message
+        }
     
     def get_related_queries(self, query: str) -> List[str]:
         """Generate related query suggestions"""
-        keywords = self._extract_keywords(query)
+        keywords = set(self._extract_keywords(query))
         
         related_queries = []
         
         # Generate related questions based on keywords
-        if any(keyword in ['gfci', 'ground', 'fault'] for keyword in keywords):
-            related_queries.extend([
-                "Where are GFCI outlets required in a kitchen?",
-                "What is the difference between GFCI and AFCI?",
-                "How do I test a GFCI outlet?"
-            ])
-        
-        if any(keyword in ['wire', 'conductor', 'size'] for keyword in keywords):
-            related_queries.extend([
-                "How do I calculate wire size for a circuit?",
-                "What is the ampacity of 12 AWG wire?",
-                "When do I need to derate wire ampacity?"
-            ])
-        
-        if any(keyword in ['box', 'fill', 'junction'] for keyword in keywords):
-            related_queries.extend([
-                "How many wires can fit in a junction box?",
-                "What size box do I need for 6 conductors?",
-                "How do I calculate box fill for devices?"
-            ])
+        for triggers, suggestions in self._REL_RULES:
+            if not triggers.isdisjoint(keywords):
+                related_queries.extend(suggestions)
+                if len(related_queries) >= self.MAX_RELATED_QUERIES:
+                    break
         
-        return related_queries[:5]  # Return up to 5 related queries
+        return related_queries[:self.MAX_RELATED_QUERIES]  # Return up to 5 related queries
 
@@ -0,0 +1,67 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+from src.models.user import User, SubscriptionTier, db
+from src.services.feature_service import FeatureService
+
+@dataclass(frozen=True, slots=True)
+class Entitlements:
+    """What a user's subscription currently allows"""
+    tier: SubscriptionTier
+    monthly_uploads: int
+    monthly_uploads_limit: Optional[int]  # None means unlimited
+    can_upload: bool
+
+class EntitlementService:
+    """
+    Per-process LRU cache of user entitlements
+    Saves the user lookup on the upload and read paths; entries live for a short
+    TTL, the least recently used are evicted past MAX_ENTRIES, and a user's
+    entry is dropped whenever their subscription or upload count changes
+    """
+
+    TTL = 30  # seconds
+    MAX_ENTRIES = 10000
+
+    _cache: 'OrderedDict[int, Tuple[float, Entitlements]]' = OrderedDict()
+    _lock = threading.Lock()
+
+    @staticmethod
+    def for_user(user: User) -> Entitlements:
+        """Compute entitlements from an already-loaded user row"""
+        return Entitlements(
+            tier=user.subscription_tier,
+            monthly_uploads=user.uploads_this_month(),
+            monthly_uploads_limit=FeatureService.for_tier(user.subscription_tier).monthly_uploads,
+            can_upload=user.can_upload()
+        )
+
+    @classmethod
+    def get(cls, user_id: int) -> Optional[Entitlements]:
+        """Return cached entitlements for a user, loading them on a miss"""
+        now = time.monotonic()
+        with cls._lock:
+            cached = cls._cache.get(user_id)
+            if cached is not None and cached[0] > now:
+                cls._cache.move_to_end(user_id)
+                return cached[1]
+
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+
+        entitlements = cls.for_user(user)
+        with cls._lock:
+            cls._cache[user_id] = (now + cls.TTL, entitlements)
+            cls._cache.move_to_end(user_id)
+            while len(cls._cache) > cls.MAX_ENTRIES:
+                cls._cache.popitem(last=False)
+        return entitlements
+
+    @classmethod
+    def invalidate(cls, user_id: int):
+        """Forget cached entitlements after a subscription or usage change"""
+        with cls._lock:
+            cls._cache.pop(user_id, None)
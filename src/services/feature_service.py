@@ -0,0 +1,70 @@
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, Tuple
+
+FEATURES_PATH = os.environ.get(
+    'FEATURES_CONFIG',
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'features.json')
+)
+
+@dataclass(frozen=True, slots=True)
+class TierFeatures:
+    """Feature toggles for one subscription tier"""
+    monthly_uploads: Optional[int]  # None means unlimited
+    image_analysis: bool
+    video_analysis: bool
+    photo_library: bool
+    code_query: bool
+    microphone: bool
+    calendar: bool
+    city_inspector_contact: bool
+    features: Tuple[str, ...] = ()
+
+def _load_feature_matrix(path: str) -> Dict[str, Dict[str, Any]]:
+    """Load the tier matrix, switching off any feature whose prerequisite is off"""
+    with open(path) as f:
+        config = json.load(f)
+    
+    requires = config.get('requires', {})
+    matrix = {}
+    for tier, toggles in config['tiers'].items():
+        toggles = dict(toggles)
+        for feature, prerequisite in requires.items():
+            if not toggles.get(prerequisite, False):
+                toggles[feature] = False
+        matrix[tier] = toggles
+    
+    return matrix
+
+class FeatureService:
+    """
+    Central lookup for what each subscription tier includes
+    The matrix is read from config/features.json once per process
+    """
+
+    _matrix = _load_feature_matrix(FEATURES_PATH)
+    _tiers = {
+        tier: TierFeatures(
+            monthly_uploads=toggles['monthly_uploads'] if isinstance(toggles['monthly_uploads'], int) else None,
+            image_analysis=toggles['image_analysis'],
+            video_analysis=toggles['video_analysis'],
+            photo_library=toggles['photo_library'],
+            code_query=toggles['code_query'],
+            microphone=toggles['microphone'],
+            calendar=toggles['calendar'],
+            city_inspector_contact=toggles['city_inspector_contact'],
+            features=tuple(toggles.get('features', ()))
+        )
+        for tier, toggles in _matrix.items()
+    }
+
+    @classmethod
+    def for_tier(cls, tier) -> TierFeatures:
+        """Look up a tier by SubscriptionTier member or its string value"""
+        return cls._tiers[getattr(tier, 'value', tier)]
+
+    @classmethod
+    def matrix(cls) -> Dict[str, Dict[str, Any]]:
+        """The full tier matrix in its public /api/features shape"""
+        return cls._matrix
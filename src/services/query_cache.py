@@ -0,0 +1,68 @@
+import hashlib
+import threading
+import time
+from typing import Dict, Any, Optional
+
+class QueryResponseCache:
+    """
+    In-process cache of code query responses keyed on the lower-cased query text
+    Entries expire after a TTL; when the cache is full the entry that is cheapest
+    to recompute (few hits, low original latency) is evicted first
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query_text: str) -> str:
+        """Hash the query with case folded (answers depend on exact spacing, so it is kept)"""
+        return hashlib.sha256(query_text.lower().encode('utf-8')).hexdigest()
+
+    def get(self, query_text: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a query, or None on a miss"""
+        key = self.make_key(query_text)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry['expires_at'] <= now:
+                del self._entries[key]
+                return None
+
+            entry['access_count'] += 1
+            return entry['response']
+
+    def set(self, query_text: str, response: Dict[str, Any], system_latency: float):
+        """Store a response along with how long it took to produce"""
+        key = self.make_key(query_text)
+        now = time.monotonic()
+
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._evict(now)
+
+            self._entries[key] = {
+                'response': response,
+                'expires_at': now + self.ttl,
+                'access_count': 0,
+                'system_latency': system_latency
+            }
+
+    def _evict(self, now: float):
+        """Drop expired entries, or the least valuable one if none have expired"""
+        expired = [key for key, entry in self._entries.items() if entry['expires_at'] <= now]
+        if expired:
+            for key in expired:
+                del self._entries[key]
+            return
+
+        victim = min(
+            self._entries,
+            key=lambda key: (self._entries[key]['access_count'] + 1) * self._entries[key]['system_latency']
+        )
+        del self._entries[victim]
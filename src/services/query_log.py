@@ -0,0 +1,90 @@
+import queue
+import threading
+from typing import Dict, Any, List
+from sqlalchemy import insert
+from src.models.user import CodeQuery, db
+
+# Every row carries the same columns so a batch is a single executemany
+_ROW_DEFAULTS = {
+    'user_id': None,
+    'query_text': None,
+    'response_text': None,
+    'code_references': None,
+    'response_time': None
+}
+
+class CodeQueryLog:
+    """
+    Group-commit writer for CodeQuery rows
+    Requests hand their row to one writer thread, which inserts everything queued
+    since its last flush with a single INSERT and commit. Each caller waits only
+    for the batch holding its row, so it still gets the new id back.
+    """
+
+    def __init__(self, app=None, max_batch: int = 100):
+        self.app = None
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['code_query_log'] = self
+
+    def record(self, **row) -> int:
+        """Queue a CodeQuery row and block until it is committed; returns its id"""
+        pending = {
+            'row': {**_ROW_DEFAULTS, **row},
+            'done': threading.Event(),
+            'id': None,
+            'error': None
+        }
+        self._ensure_writer()
+        self._queue.put(pending)
+        pending['done'].wait()
+
+        if pending['error'] is not None:
+            raise pending['error']
+        return pending['id']
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name='code-query-log', daemon=True)
+                self._writer.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: List[Dict[str, Any]]):
+        try:
+            with self.app.app_context():
+                result = db.session.execute(
+                    insert(CodeQuery).returning(CodeQuery.id, sort_by_parameter_order=True),
+                    [pending['row'] for pending in batch]
+                )
+                ids = result.scalars().all()
+                db.session.commit()
+
+            for pending, row_id in zip(batch, ids):
+                pending['id'] = row_id
+        except Exception as e:
+            for pending in batch:
+                pending['error'] = e
+        finally:
+            for pending in batch:
+                pending['done'].set()
+
+code_query_log = CodeQueryLog()
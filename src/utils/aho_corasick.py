@@ -0,0 +1,55 @@
+from collections import deque
+from typing import Iterable, Set
+
+class AhoCorasick:
+    """
+    Aho–Corasick automaton over a fixed set of strings
+    find_all() reports every pattern that occurs anywhere in a text in a single
+    left-to-right pass, however many patterns there are.
+    """
+
+    def __init__(self, patterns: Iterable[str]):
+        self._goto = [{}]
+        self._fail = [0]
+        outputs = [[]]
+
+        # Trie of all patterns
+        for pattern in patterns:
+            state = 0
+            for char in pattern:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    outputs.append([])
+                state = next_state
+            outputs[state].append(pattern)
+
+        # Failure links, breadth first; each state also reports what its fallback state reports
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                outputs[next_state].extend(outputs[self._fail[next_state]])
+                queue.append(next_state)
+
+        self._output = [tuple(found) for found in outputs]
+
+    def find_all(self, text: str) -> Set[str]:
+        """Distinct patterns occurring in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
@@ -0,0 +1,32 @@
+import orjson
+from flask.json.provider import JSONProvider
+
+# Same encoding for API responses and JSON columns; numpy values come from the analysis services
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def column_json_dumps(obj):
+    """SQLAlchemy json_serializer for JSON columns"""
+    return orjson.dumps(obj, option=ORJSON_OPTIONS).decode('utf-8')
+
+def column_json_loads(s):
+    """SQLAlchemy json_deserializer for JSON columns"""
+    return orjson.loads(s)
+
+class ORJSONProvider(JSONProvider):
+    """
+    Flask JSON provider backed by orjson
+    Serializes datetimes as ISO 8601 and accepts numpy values from the analysis services
+    """
+
+    option = ORJSON_OPTIONS
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        """Build a JSON response straight from orjson's bytes"""
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, option=self.option), mimetype='application/json')
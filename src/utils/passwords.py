@@ -0,0 +1,28 @@
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from gevent.threadpool import ThreadPool
+from werkzeug.security import check_password_hash
+
+# RFC 9106 low-memory profile, roughly 50ms per hash on a server core
+_hasher = PasswordHasher(time_cost=3, memory_cost=64 * 1024, parallelism=1)
+
+# Hashing is CPU-bound; run it on native threads so the gevent hub keeps
+# serving other requests. The pool size bounds concurrent hashing work.
+_pool = ThreadPool(4)
+
+def hash_password(password):
+    """Hash a password with argon2id"""
+    return _pool.apply(_hasher.hash, (password,))
+
+def verify_password(password_hash, password):
+    """Check a password against an argon2 hash or a legacy werkzeug hash"""
+    if not password_hash.startswith('$argon2'):
+        return _pool.apply(check_password_hash, (password_hash, password))
+    try:
+        return _pool.apply(_hasher.verify, (password_hash, password))
+    except (VerificationError, InvalidHashError):
+        return False
+
+def needs_rehash(password_hash):
+    """Check if a stored hash predates the current algorithm or parameters"""
+    return not password_hash.startswith('$argon2') or _hasher.check_needs_rehash(password_hash)
@@ -0,0 +1,22 @@
+import hashlib
+import orjson
+from flask import Response, request
+
+class StaticJSON:
+    """
+    JSON payload serialized once at import time
+    Served as pre-encoded bytes with an ETag so clients can revalidate with a 304
+    """
+
+    def __init__(self, payload, max_age=3600):
+        self.body = orjson.dumps(payload)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.max_age = max_age
+
+    def response(self):
+        """Build the response for the current request, honoring If-None-Match"""
+        response = Response(self.body, mimetype='application/json')
+        response.set_etag(self.etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = self.max_age
+        return response.make_conditional(request)
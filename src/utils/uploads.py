@@ -0,0 +1,36 @@
+import os
+import shutil
+import tempfile
+from flask import Request, current_app
+
+# Copy in 1MB chunks when the spooled upload can't be linked into place
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class UploadRequest(Request):
+    """
+    Request that spools multipart file parts straight into UPLOAD_FOLDER
+    Werkzeug keeps small parts in memory and larger ones in a temp file under
+    the system temp dir, and file.save() then copies them again. Writing every
+    part to the upload volume lets save_upload() hard-link it into place.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.NamedTemporaryFile('wb+', dir=current_app.config['UPLOAD_FOLDER'], prefix='.upload-')
+
+def save_upload(file, file_path: str) -> int:
+    """Store an uploaded FileStorage at file_path and return its size in bytes"""
+    stream = file.stream
+    spooled_path = getattr(stream, 'name', None)
+
+    if isinstance(spooled_path, str):
+        try:
+            stream.flush()
+            os.link(spooled_path, file_path)
+            return os.fstat(stream.fileno()).st_size
+        except (AttributeError, OSError):
+            pass
+
+    stream.seek(0)
+    with open(file_path, 'wb') as out:
+        shutil.copyfileobj(stream, out, COPY_CHUNK_SIZE)
+        return os.fstat(out.fileno()).st_size
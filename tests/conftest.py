@@ -0,0 +1,48 @@
+import os
+import sys
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.models.user import db
+from src.routes.auth import auth_bp
+from src.routes.code import code_bp, response_cache
+from src.routes.inspection import inspection_bp
+from src.services.entitlements import EntitlementService
+from src.services.query_log import code_query_log
+from src.utils.json_provider import ORJSONProvider
+from src.utils.uploads import UploadRequest
+
+@pytest.fixture
+def app(tmp_path):
+    """App wired like src.main, minus the AI services, on an in-memory SQLite database"""
+    app = Flask(__name__)
+    app.config.update(
+        TESTING=True,
+        SQLALCHEMY_DATABASE_URI='sqlite://',
+        UPLOAD_FOLDER=str(tmp_path)
+    )
+    app.json = ORJSONProvider(app)
+    app.request_class = UploadRequest
+    app.register_blueprint(auth_bp, url_prefix='/api/auth')
+    app.register_blueprint(inspection_bp, url_prefix='/api')
+    app.register_blueprint(code_bp, url_prefix='/api')
+
+    db.init_app(app)
+    code_query_log.init_app(app)
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+    # Process-wide caches outlive each app
+    EntitlementService._cache.clear()
+    response_cache._entries.clear()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
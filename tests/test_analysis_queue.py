@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.models.user import Inspection, InspectionImage, InspectionVideo, SubscriptionTier, User, db
+from src.services.analysis_queue import AnalysisQueue
+
+@pytest.fixture
+def queue(app):
+    queue = AnalysisQueue()
+    queue.app = app
+    queue.stale_after = 15 * 60
+    return queue
+
+@pytest.fixture
+def inspection():
+    user = User(username='inspector', email='inspector@example.com', subscription_tier=SubscriptionTier.ENTERPRISE)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.flush()
+
+    inspection = Inspection(user_id=user.id)
+    db.session.add(inspection)
+    db.session.commit()
+    return inspection
+
+def add_image(inspection, analysis_result, age):
+    image = InspectionImage(
+        inspection_id=inspection.id, filename='f.png', file_path='/tmp/f.png',
+        analysis_result=analysis_result, uploaded_at=datetime.utcnow() - age
+    )
+    db.session.add(image)
+    return image
+
+def test_expire_stale_fails_old_pending_rows_only(queue, inspection):
+    stale = add_image(inspection, 'pending', timedelta(hours=1))
+    fresh = add_image(inspection, 'pending', timedelta(minutes=1))
+    done = add_image(inspection, 'pass', timedelta(hours=1))
+    stale_video = InspectionVideo(
+        inspection_id=inspection.id, filename='f.mp4', file_path='/tmp/f.mp4',
+        overall_result='pending', uploaded_at=datetime.utcnow() - timedelta(hours=1)
+    )
+    db.session.add(stale_video)
+    db.session.commit()
+
+    assert queue.expire_stale() == 2
+
+    db.session.expire_all()
+    assert stale.analysis_result == 'error'
+    assert stale_video.overall_result == 'error'
+    assert fresh.analysis_result == 'pending'
+    assert done.analysis_result == 'pass'
+
+def test_queue_depth(queue, monkeypatch):
+    monkeypatch.setattr('src.services.analysis_queue.gevent.spawn', lambda *args: None)
+    queue.max_depth = 2
+
+    queue.submit_image(1, '/tmp/a.png')
+    assert not queue.is_full()
+    queue.submit_video(2, '/tmp/b.mp4')
+    assert queue.is_full()
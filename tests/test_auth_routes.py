@@ -0,0 +1,19 @@
+from src.models.user import Subscription, SubscriptionTier, User, db
+from src.services.entitlements import EntitlementService
+
+def test_subscription_tier_matches_after_update_elsewhere(client):
+    user = User(username='inspector', email='inspector@example.com', subscription_tier=SubscriptionTier.FREEMIUM)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.commit()
+    assert EntitlementService.get(user.id).tier is SubscriptionTier.FREEMIUM
+
+    # Upgrade committed by another worker, leaving this worker's cache entry stale
+    user.subscription_tier = SubscriptionTier.PROFESSIONAL
+    db.session.add(Subscription(user_id=user.id, tier=SubscriptionTier.PROFESSIONAL))
+    db.session.commit()
+
+    body = client.get(f'/api/auth/users/{user.id}/subscription').get_json()
+
+    assert body['user_tier'] == 'professional'
+    assert body['subscription']['tier'] == 'professional'
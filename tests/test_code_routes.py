@@ -0,0 +1,46 @@
+import pytest
+
+from src.services.code_query_service import CodeQueryService, _NEC_DATABASE, _QUERY_PATTERNS
+
+# One question per query pattern, in the words the pattern looks for
+PATTERN_QUERIES = {
+    'gfci': 'Is GFCI required in a garage?',
+    'grounding': 'What size grounding conductor do I need?',
+    'box_fill': 'Junction box calculation for 6 conductors',
+    'clearance': 'Panel clearance distance in feet'
+}
+
+KEYWORD_QUERIES = sorted({keyword for section_data in _NEC_DATABASE.values() for keyword in section_data['keywords']})
+
+def ask(client, query):
+    response = client.post('/api/code/query', json={'query': query})
+    assert response.status_code == 200
+    return response.get_json()
+
+def test_every_pattern_has_a_query():
+    assert set(PATTERN_QUERIES) == {p['name'] for p in _QUERY_PATTERNS}
+
+@pytest.mark.parametrize('pattern', _QUERY_PATTERNS, ids=lambda p: p['name'])
+def test_pattern_queries_are_answered(client, pattern):
+    body = ask(client, PATTERN_QUERIES[pattern['name']])
+
+    assert body['response'] != CodeQueryService.OFF_TOPIC_RESPONSE['response']
+    assert body['references'][0]['section'] == pattern['primary_reference']
+
+@pytest.mark.parametrize('keyword', KEYWORD_QUERIES + ['overcurrent protection rules', 'table 250.66'])
+def test_keyword_queries_are_not_off_topic(client, keyword):
+    body = ask(client, keyword)
+
+    assert body['response'] != CodeQueryService.OFF_TOPIC_RESPONSE['response']
+    assert body['references']
+
+def test_unrelated_query_is_off_topic(client):
+    assert ask(client, 'What is the capital of France?')['response'] == CodeQueryService.OFF_TOPIC_RESPONSE['response']
+
+def test_cache_key_keeps_spacing(client):
+    spaced = ask(client, 'wire  size for outdoor outlet')
+    single = ask(client, 'wire size for outdoor outlet')
+
+    assert not single['cached']
+    assert single['response'] == CodeQueryService().process_query('wire size for outdoor outlet')['response']
+    assert spaced['response'] == CodeQueryService().process_query('wire  size for outdoor outlet')['response']
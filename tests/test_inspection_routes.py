@@ -0,0 +1,134 @@
+import io
+
+import pytest
+from sqlalchemy import event
+
+from src.models.user import Inspection, InspectionImage, MONTHLY_UPLOAD_LIMITS, SubscriptionTier, User, db
+from src.services import analysis_queue as analysis_queue_module
+from src.services.entitlements import EntitlementService
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """Analysis jobs handed to the queue, without running the AI services"""
+    jobs = []
+    monkeypatch.setattr(analysis_queue_module.analysis_queue, 'submit_image', lambda *job: jobs.append(job))
+    return jobs
+
+@pytest.fixture
+def inspection():
+    user = User(username='inspector', email='inspector@example.com', subscription_tier=SubscriptionTier.FREEMIUM)
+    user.set_password('secret')
+    db.session.add(user)
+    db.session.flush()
+
+    inspection = Inspection(user_id=user.id, project_name='Panel upgrade')
+    db.session.add(inspection)
+    db.session.commit()
+    return inspection
+
+def upload(client, inspection_id):
+    return client.post(
+        f'/api/inspections/{inspection_id}/upload-image',
+        data={'file': (io.BytesIO(b'\x89PNG\r\n\x1a\n'), 'panel.png')},
+        content_type='multipart/form-data'
+    )
+
+def test_upload_image_queues_analysis(client, inspection, submitted):
+    response = upload(client, inspection.id)
+
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['image']['analysis_result'] == 'pending'
+    assert body['remaining_uploads'] == MONTHLY_UPLOAD_LIMITS[SubscriptionTier.FREEMIUM] - 1
+    assert submitted == [(body['image']['id'], db.session.get(InspectionImage, body['image']['id']).file_path)]
+    assert db.session.get(User, inspection.user_id).monthly_uploads == 1
+
+def test_upload_image_rejected_at_monthly_limit(client, inspection, submitted):
+    limit = MONTHLY_UPLOAD_LIMITS[SubscriptionTier.FREEMIUM]
+    for _ in range(limit):
+        assert upload(client, inspection.id).status_code == 202
+
+    response = upload(client, inspection.id)
+
+    assert response.status_code == 403
+    assert response.get_json()['limit'] == limit
+    assert len(submitted) == limit
+    assert InspectionImage.query.count() == limit
+
+def test_upload_limit_response_reports_current_count(client, inspection, submitted):
+    limit = MONTHLY_UPLOAD_LIMITS[SubscriptionTier.FREEMIUM]
+    assert EntitlementService.get(inspection.user_id).can_upload
+
+    # Another worker counted uploads past this worker's cached entry
+    user = db.session.get(User, inspection.user_id)
+    user.monthly_uploads = limit + 2
+    db.session.commit()
+
+    response = upload(client, inspection.id)
+
+    assert response.status_code == 403
+    assert response.get_json()['monthly_uploads'] == limit + 2
+    assert response.get_json()['limit'] == limit
+
+def test_upload_ignores_stale_cached_limit(client, inspection, submitted):
+    limit = MONTHLY_UPLOAD_LIMITS[SubscriptionTier.FREEMIUM]
+    user = db.session.get(User, inspection.user_id)
+    user.monthly_uploads = limit
+    db.session.commit()
+    assert not EntitlementService.get(inspection.user_id).can_upload
+
+    # Upgraded on another worker, which can't clear this worker's cache
+    user.subscription_tier = SubscriptionTier.ENTERPRISE
+    db.session.commit()
+
+    response = upload(client, inspection.id)
+
+    assert response.status_code == 202
+    assert response.get_json()['remaining_uploads'] == 'unlimited'
+
+def test_upload_rejected_while_analysis_queue_full(client, inspection, submitted, monkeypatch):
+    monkeypatch.setattr(analysis_queue_module.analysis_queue, 'is_full', lambda: True)
+
+    response = upload(client, inspection.id)
+
+    assert response.status_code == 503
+    assert db.session.get(User, inspection.user_id).monthly_uploads == 0
+    assert not submitted
+
+def test_image_status_is_polled_until_analysis_finishes(client, inspection, submitted):
+    image_id = upload(client, inspection.id).get_json()['image']['id']
+
+    response = client.get(f'/api/inspections/{inspection.id}/images/{image_id}')
+
+    assert response.status_code == 200
+    assert response.get_json()['analysis_result'] == 'pending'
+
+@pytest.mark.parametrize('kind', ['images', 'videos'])
+def test_unknown_upload_status_is_not_found(client, inspection, kind):
+    assert client.get(f'/api/inspections/{inspection.id}/{kind}/999').status_code == 404
+
+@pytest.fixture
+def statements():
+    """SQL run against the test database"""
+    executed = []
+    listener = lambda conn, cursor, statement, *args: executed.append(statement)
+    event.listen(db.engine, 'before_cursor_execute', listener)
+    yield executed
+    event.remove(db.engine, 'before_cursor_execute', listener)
+
+def test_upload_does_not_count_inspection_children(client, inspection, submitted, statements):
+    assert upload(client, inspection.id).status_code == 202
+
+    assert not any('count(' in statement.lower() for statement in statements)
+
+def test_inspection_listing_loads_counts_with_rows(client, inspection, submitted, statements):
+    upload(client, inspection.id)
+    db.session.get(User, inspection.user_id).subscription_tier = SubscriptionTier.PROFESSIONAL
+    db.session.commit()
+    statements.clear()
+
+    body = client.get(f'/api/users/{inspection.user_id}/inspections').get_json()
+
+    assert [(i['image_count'], i['video_count']) for i in body['inspections']] == [(1, 0)]
+    # Counted in the page query itself, never per row or in the total count
+    assert sum('from inspection_image' in statement.lower() for statement in statements) == 1